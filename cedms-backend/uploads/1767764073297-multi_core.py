@@ -1,65 +1,95 @@
 from mpi4py import MPI
+import argparse
 import numpy as np
-import time
-
-# --------------------------
-# 1. Set up MPI
-# --------------------------
-comm = MPI.COMM_WORLD
-rank = comm.rank
-size = comm.size
-
-# --------------------------
-# 2. Problem and timestep settings
-# --------------------------
-N = 10_000_000      # total size of array (global)
-num_steps = 5       # number of timesteps
-dt = 0.1            # timestep size
-
-# --------------------------
-# 3. Distribute the array across ranks
-# --------------------------
-# Simple partition: first 'remainder' ranks get one extra element
-base_local_n = N // size
-remainder = N % size
-
-if rank < remainder:
-    local_n = base_local_n + 1
-else:
-    local_n = base_local_n
-
-# Each rank stores only its local part
-local_u = np.ones(local_n, dtype=float)
-
-# --------------------------
-# 4. Time-stepping loop
-# --------------------------
-start_time = MPI.Wtime()   # MPI wall-clock time (works in parallel)
-
-for step in range(num_steps):
-    t = (step + 1) * dt
-
-    # Local update: same operation on each rank's local chunk
-    local_u += dt
-
-    # Local sum on each rank
-    local_sum = np.sum(local_u)
-
-    # Global sum across all ranks
-    global_sum = comm.allreduce(local_sum, op=MPI.SUM)
-
-    # Only rank 0 prints the global info
-    if rank == 0:
-        print(f"[parallel] step = {step+1}, t = {t:.2f}, global_total = {global_sum:.2f}")
 
-end_time = MPI.Wtime()
-elapsed = end_time - start_time
+from kernel_benchmark import (add_benchmark_arguments, compare_kernels, expected_totals, format_summary,
+                              get_kernel, load_baseline, max_relative_error, partition, summarize, time_kernel,
+                              write_results)
+
+
+def main(argv=None):
+    parser = add_benchmark_arguments(argparse.ArgumentParser(
+        description="MPI benchmark of the u += dt / global total timestep kernels"))
+    parser.add_argument("--baseline", help="single_core.py --json results for the serial baseline "
+                                           "(default: measured on rank 0 before the parallel runs)")
+    args = parser.parse_args(argv)
+
+    # --------------------------
+    # 1. Set up MPI
+    # --------------------------
+    comm = MPI.COMM_WORLD
+    rank = comm.rank
+    size = comm.size
+
+    # --------------------------
+    # 2. Problem and timestep settings
+    # --------------------------
+    N, num_steps, dt = args.n, args.steps, args.dt
+    dtype = np.dtype(args.dtype)
+
+    # --------------------------
+    # 3. Distribute the array across ranks
+    # --------------------------
+    # Each rank stores only its local part (allocated outside the timed region)
+    # Simple partition: first 'remainder' ranks get one extra element
+    start, stop = partition(N, size)[rank]
+    local_n = stop - start
+
+    def make_local_array():
+        return np.ones(local_n, dtype=dtype)
+
+    def allreduce(local_sum):
+        return comm.allreduce(local_sum, op=MPI.SUM)
+
+    def max_time(elapsed):
+        # Max time across ranks: the worst-case rank sets the runtime
+        return comm.allreduce(elapsed, op=MPI.MAX)
+
+    results = {"mode": "mpi", "n": N, "steps": num_steps, "dt": dt, "dtype": dtype.name,
+               "warmup": args.warmup, "block_size": args.block_size, "ranks": size, "kernels": {}}
+
+    # --------------------------
+    # 4. Timed runs of each kernel
+    # --------------------------
+    for name in args.kernels:
+        kernel, traffic = get_kernel(name, block=args.block_size)
+
+        # Serial baseline for the parallel efficiency (same kernel over all N on rank 0)
+        baseline_s = None
+        if args.baseline:
+            baseline_s = load_baseline(args.baseline, name)
+        elif rank == 0:
+            baseline_times, _ = time_kernel(kernel, lambda: np.ones(N, dtype=dtype), num_steps, dt,
+                                            repeats=args.repeats, warmup=args.warmup)
+            baseline_s = float(np.median(baseline_times))
+        baseline_s = comm.bcast(baseline_s, root=0)
+
+        times, totals = time_kernel(kernel, make_local_array, num_steps, dt,
+                                    repeats=args.repeats, warmup=args.warmup,
+                                    allreduce=allreduce, barrier=comm.Barrier, max_time=max_time)
+        summary = summarize(times, N, dtype.itemsize, num_steps, traffic, workers=size,
+                            baseline_s=baseline_s, percentiles=args.percentiles)
+        summary["final_total"] = totals[-1]
+        summary["max_relative_error"] = max_relative_error(totals, expected_totals(N, num_steps, dt))
+        results["kernels"][name] = summary
+
+        # Only rank 0 prints the global info
+        if rank == 0:
+            print(format_summary(f"parallel:{name}", summary)
+                  + f", global_total={totals[-1]:.2f} (rel. error {summary['max_relative_error']:.1e})")
+
+    # --------------------------
+    # 5. Results
+    # --------------------------
+    comparison = compare_kernels(results["kernels"])
+    if rank == 0:
+        for line in comparison:
+            print(f"[parallel] {line}")
+    if args.json and rank == 0:
+        write_results(args.json, results)
+        print(f"[parallel] Results written to {args.json} (size = {size})")
+    return results
 
-# --------------------------
-# 5. Timing info
-# --------------------------
-# Get max time across ranks to see worst-case runtime
-max_elapsed = comm.reduce(elapsed, op=MPI.MAX, root=0)
 
-if rank == 0:
-    print(f"[parallel] Max time across ranks: {max_elapsed:.3f} seconds (size = {size})")
+if __name__ == "__main__":
+    main()
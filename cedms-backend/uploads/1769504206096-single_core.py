@@ -1,25 +1,47 @@
-import time
+import argparse
 import numpy as np
 
-# Problem size
-N = 10_000_000      # length of array (big enough to see some time)
-num_steps = 5       # number of timesteps
-dt = 0.1            # timestep size
+from kernel_benchmark import (add_benchmark_arguments, compare_kernels, expected_totals, format_summary,
+                              get_kernel, max_relative_error, summarize, time_kernel, write_results)
 
-# Initial condition: u(x, 0) = 1 for all x
-u = np.ones(N, dtype=float)
 
-start_time = time.time()
+def main(argv=None):
+    parser = add_benchmark_arguments(argparse.ArgumentParser(
+        description="Serial benchmark of the u += dt / total timestep kernels"))
+    args = parser.parse_args(argv)
 
-for step in range(num_steps):
-    t = (step + 1) * dt  # current time
+    # Problem size: length of array, number of timesteps and timestep size
+    N, num_steps, dt = args.n, args.steps, args.dt
+    dtype = np.dtype(args.dtype)
 
-    # Simple "update": u = u + dt
-    u += dt
+    # Initial condition: u(x, 0) = 1 for all x (allocated outside the timed region)
+    def make_array():
+        return np.ones(N, dtype=dtype)
 
-    # Diagnostics (single core, so we can just sum directly)
-    total = np.sum(u)
-    print(f"[single] step = {step+1}, t = {t:.2f}, total = {total:.2f}")
+    results = {"mode": "single", "n": N, "steps": num_steps, "dt": dt, "dtype": dtype.name,
+               "warmup": args.warmup, "block_size": args.block_size, "kernels": {}}
+    for name in args.kernels:
+        kernel, traffic = get_kernel(name, block=args.block_size)
+        times, totals = time_kernel(kernel, make_array, num_steps, dt,
+                                    repeats=args.repeats, warmup=args.warmup)
+        summary = summarize(times, N, dtype.itemsize, num_steps, traffic, percentiles=args.percentiles)
 
-end_time = time.time()
-print(f"[single] Finished in {end_time - start_time:.3f} seconds")
+        # Diagnostics of the last run (single core, so the totals are global)
+        summary["final_total"] = totals[-1]
+        summary["max_relative_error"] = max_relative_error(totals, expected_totals(N, num_steps, dt))
+        results["kernels"][name] = summary
+        print(format_summary(f"single:{name}", summary)
+              + f", total={totals[-1]:.2f} (rel. error {summary['max_relative_error']:.1e})")
+
+    # Fused single-pass kernels against the two-pass update + sum
+    for line in compare_kernels(results["kernels"]):
+        print(f"[single] {line}")
+
+    if args.json:
+        write_results(args.json, results)
+        print(f"[single] Results written to {args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
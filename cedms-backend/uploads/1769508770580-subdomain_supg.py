@@ -4,29 +4,37 @@ Layered species + Darcy simulation (DOLFINx 0.9.0)
 - Domain: [0,1] x [0,1]
 - Left 40%: anode, Middle 20%: membrane (fine mesh), Right 40%: cathode
 - Species balanced weak form in anode & cathode & membrane (region constants differ)
-- Darcy weak form (velocity+pressure) solved in membrane region (for visualization only)
+- Darcy weak form (velocity+pressure) solved on a membrane submesh (for visualization only)
 - Initial concentration of Na+: anode & membrane 0.54, cathode 1.0
 - Boundary conditions: Bottom of anode c=0.54, Bottom of cathode c=1.0
-- Simulate 2s with 10 timesteps; visualize mesh & concentration each step
+- Simulate 2s with 10 timesteps; concentration and Darcy fields streamed to one
+  XDMF/HDF5 (or VTX) time series, optional HTML snapshots
 """
 
 import os
+import sys
+import copy
 import time
 import json
+import resource
+from contextlib import contextmanager
+from functools import cached_property
 from datetime import datetime
 import psutil
 
 import numpy as np
 from mpi4py import MPI
-import pyvista
+from petsc4py import PETSc
 
 import ufl
 import dolfinx
+import dolfinx.io
 from dolfinx import mesh as dmesh
 from dolfinx import plot
 from dolfinx import default_scalar_type as ScalarType
 import dolfinx.fem as fem
-from dolfinx.fem.petsc import LinearProblem
+from dolfinx.fem.petsc import (assemble_matrix, assemble_vector, apply_lifting,
+                               create_matrix, create_vector, set_bc)
 from basix.ufl import element as basix_element
 from basix.ufl import mixed_element
 from dolfinx.mesh import locate_entities_boundary,meshtags
@@ -37,14 +45,21 @@ from dolfinx.mesh import locate_entities_boundary,meshtags
 # ------------------------------
 # Helper functions
 # ------------------------------
-def set_layered_initial_conditions(V, ion_name):
-    """Set initial concentration based on x-coordinate regions"""
+def set_layered_initial_conditions(V, ion_name, values=None):
+    """
+    Set initial concentration based on x-coordinate regions
+    (values: {region name: concentration}, overrides the built-in Na+ profile)
+    """
     c = fem.Function(V)
 
     def initial_concentration(x):
         conc = np.zeros(x.shape[1])
         
-        if ion_name == "Na+":
+        if values is not None:
+            markers = region_markers(x[0])
+            for region_id, (region_name, _, _) in REGION_INTERVALS.items():
+                conc[markers == region_id] = values.get(region_name, 0.0)
+        elif ion_name == "Na+":
             # Anode region (0 to 0.4): 0.54 M
             conc[x[0] <= 0.4] = 0.54
             # Membrane region (0.4 to 0.6): 0.54 M
@@ -72,10 +87,8 @@ def create_function_space_layered(domain, degree=3):
     return V
 
 
-def visualize_layered_solution(image_path, domain, c, title="Layered Concentration"):
-    """Visualize solution with layer boundaries visible"""
-    
-    # Project to P1 for visualization
+def create_p1_space(domain):
+    """P1 Lagrange space used for visualization"""
     try:
         el_p1 = basix_element("Lagrange", domain.topology.cell_name(), 1)
         V_p1 = fem.functionspace(domain, el_p1)
@@ -85,22 +98,19 @@ def visualize_layered_solution(image_path, domain, c, title="Layered Concentrati
             V_p1 = fem.functionspace(domain, el_p1)
         except:
             V_p1 = fem.functionspace(domain, ("Lagrange", 1))
-    
-    c_p1 = fem.Function(V_p1)
-    c_p1.interpolate(c)
-    
-    topology, cell_types, geometry = plot.vtk_mesh(domain)
+    return V_p1
+
+
+def render_concentration_html(image_path, topology, cell_types, geometry, values,
+                              title="Layered Concentration", output_dir="assets", show=True):
+    """Render P1 concentration values on a VTK grid with the layer boundaries and export HTML"""
+    # pyvista pulls in VTK: imported only when a frame is actually rendered
+    import pyvista
+
     grid = pyvista.UnstructuredGrid(topology, cell_types, geometry)
-    
-    # Convert to numpy array for safety
-    try:
-        arr = np.array(c_p1.x.array)
-    except:
-        arr = c_p1.x.array
-    
-    grid.point_data["concentration"] = arr
-    
-    plotter = pyvista.Plotter(window_size=(1200, 800))
+    grid.point_data["concentration"] = np.asarray(values)
+
+    plotter = pyvista.Plotter(window_size=(1200, 800), off_screen=not show)
     plotter.add_mesh(grid, scalars="concentration", show_edges=False,
                     scalar_bar_args={'title': 'Concentration [M]'},
                     cmap='RdBu',
@@ -128,605 +138,3368 @@ def visualize_layered_solution(image_path, domain, c, title="Layered Concentrati
     ]
     
     # Ensure assets folder exists
-    os.makedirs("assets", exist_ok=True)
-    plotter.export_html(f"assets/{image_path}.html")
+    os.makedirs(output_dir, exist_ok=True)
+    plotter.export_html(f"{output_dir}/{image_path}.html")
     
     # Show plot (will skip in headless mode)
-    try:
-        plotter.show()
-    except Exception:
-        pass
+    if show:
+        try:
+            plotter.show()
+        except Exception:
+            pass
+    plotter.close()
 
-# ------------------------------
-# Simulation parameters & constants
-# ------------------------------
-petsc_options = {
-    "ksp_type": "gmres",
-    "pc_type": "ilu",
-    "ksp_rtol": 1e-8,
-    "ksp_atol": 1e-10,
-    "ksp_max_it": 1000
-}
-# New PETSc options for the Darcy solve (uses Direct LU solver)
-darcy_petsc_options = {
-    "ksp_type": "preonly",         # Use only the preconditioner (i.e., direct solve)
-    "pc_type": "lu",               # LU factorization (Direct Solver)
-    "pc_factor_mat_solver_type": "mumps" # Use mumps or superlu_dist for the factorization
-}
 
-# Region-specific constants for species transport
-region_constants = {
-    "anode":    {"Pe": 100.0,    "gamma": 1.0, "Ri": 0.0},
-    "membrane": {"Pe": 100.0, "gamma": 1.0,    "Ri": 0.0},
-    "cathode":  {"Pe": 100.0,    "gamma": 1.0, "Ri": 0.0},
-}
+def visualize_layered_solution(image_path, domain, c, title="Layered Concentration"):
+    """Visualize solution with layer boundaries visible (synchronous)"""
+    
+    # Project to P1 for visualization
+    V_p1 = create_p1_space(domain)
+    c_p1 = fem.Function(V_p1)
+    c_p1.interpolate(c)
+    
+    # Grid points follow the P1 DOF ordering, so the array maps 1:1
+    topology, cell_types, geometry = plot.vtk_mesh(V_p1)
+    render_concentration_html(image_path, topology, cell_types, geometry, c_p1.x.array.copy(), title)
+
+
+# Grid arrays held by each background render worker (sent once at pool start)
+_render_grid = None
 
-# Global species parameters
-z_i_c = 1.0   # valence of Na+ ion
-Pe_max = 100.0 # Using Pe as Pe_max for migration in the stabilization term (from user's equation)
 
-# Darcy parameters (for membrane region)
-Re_val = 100.0  # Reynolds number
-Da_val = 1e-5   # Darcy number
+def _init_render_worker(topology, cell_types, geometry):
+    global _render_grid
+    _render_grid = (topology, cell_types, geometry)
 
-# Temporal parameters
-T = 30.0          # Total simulation time [s]
-num_steps = 5   # Number of timesteps
-dt = T / float(num_steps)
 
-comm = MPI.COMM_WORLD
+def _render_worker_frame(image_path, values, title, output_dir):
+    render_concentration_html(image_path, *_render_grid, values, title, output_dir=output_dir, show=False)
+    return image_path
+
+
+class AsyncVisualizer:
+    """
+    Off-critical-path visualization of the concentration field.
+    - The P1 space, interpolation target and VTK grid arrays are built once
+    - submit() interpolates into P1, snapshots the array and hands it to a
+      background process pool that renders and exports the HTML
+    - At most max_pending frames are in flight; further frames are dropped
+      (never waited on), so memory stays bounded and the solver never blocks
+    - every=N only renders every Nth step unless a frame is forced; a forced
+      frame (t=0, final step) is never dropped, it waits for the oldest
+      pending frame when the queue is full
+    """
 
+    def __init__(self, domain, every=1, max_pending=4, workers=1, output_dir="assets",
+                 mp_context="spawn"):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.every = max(1, int(every))
+        self.max_pending = max(1, int(max_pending))
+        self.output_dir = output_dir
+        # Ranks render only their local part; keep their files apart in parallel
+        self.suffix = f"_r{domain.comm.rank}" if domain.comm.size > 1 else ""
+
+        self.V_p1 = create_p1_space(domain)
+        self.c_p1 = fem.Function(self.V_p1)
+        grid_arrays = plot.vtk_mesh(self.V_p1)
+
+        # Render workers are spawned, not forked from a rank with MPI/PETSc initialized;
+        # the grid arrays reach them through initargs
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context(mp_context),
+            initializer=_init_render_worker, initargs=grid_arrays)
+        self.pending = []
+        self.num_submitted = 0
+        self.num_dropped = 0
+
+    def wants(self, step, force=False):
+        return force or step % self.every == 0
+
+    def _reap(self):
+        """Drop finished frames from the pending list, reporting failures"""
+        still_pending = []
+        for name, future in self.pending:
+            if not future.done():
+                still_pending.append((name, future))
+            elif future.exception() is not None:
+                print(f"  Warning: Visualization of {name} failed - {future.exception()}")
+        self.pending = still_pending
+
+    def submit(self, step, image_path, c, title, force=False):
+        """Queue a frame for background rendering; returns False if skipped or dropped"""
+        from concurrent.futures import wait
+
+        if not self.wants(step, force):
+            return False
+        self._reap()
+        while len(self.pending) >= self.max_pending:
+            if not force:
+                self.num_dropped += 1
+                return False
+            wait([self.pending[0][1]])
+            self._reap()
+
+        self.c_p1.interpolate(c)
+        snapshot = self.c_p1.x.array.copy()
+        name = f"{image_path}{self.suffix}"
+        future = self.pool.submit(_render_worker_frame, name, snapshot, title, self.output_dir)
+        self.pending.append((name, future))
+        self.num_submitted += 1
+        return True
+
+    def close(self):
+        """Wait for in-flight frames and stop the pool"""
+        self.pool.shutdown(wait=True)
+        self._reap()
 
 
 # ------------------------------
-# Build a non-uniform structured mesh
+# Parallel time-series output
 # ------------------------------
-def create_layered_structured_mesh(comm, ny=40, n_anode=20, n_mem=120, n_cathode=20):
+class TimeSeriesWriter:
     """
-    Create a structured mesh with variable resolution:
-    - Anode (0 to 0.4): coarse (n_anode elements)
-    - Membrane (0.4 to 0.6): fine (n_mem elements)
-    - Cathode (0.6 to 1.0): coarse (n_cathode elements)
+    Streaming, collective time-series output of the simulation fields.
+    - "xdmf": one XDMF/HDF5 file; the mesh is written once and every field is
+      appended per step (fields are interpolated to P1, as XDMF requires)
+    - "vtx": ADIOS2 VTX (.bp) output at the native degree; VTX needs one
+      element per file, so each field gets its own .bp directory
+    All ranks must call write() together.
     """
-    # ... (code to build x_coords, y_coords, points, and cells remains the same) ...
-    x_anode = np.linspace(0.0, 0.4, n_anode + 1, endpoint=True)
-    x_mem = np.linspace(0.4, 0.6, n_mem + 1, endpoint=True)[1:]
-    x_cath = np.linspace(0.6, 1.0, n_cathode + 1, endpoint=True)[1:]
-    x_coords = np.concatenate([x_anode, x_mem, x_cath])
-    y_coords = np.linspace(0.0, 1.0, ny + 1, endpoint=True)
 
-    # Create grid points
-    points = []
-    for y in y_coords:
-        for x in x_coords:
-            points.append([x, y, 0.0])
-    points = np.array(points, dtype=np.float64)
+    def __init__(self, domain, fields, output_dir="output", fmt="xdmf", engine="BP4", suffix=""):
+        self.comm = domain.comm
+        self.fmt = fmt
+        self.fields = list(fields)
+        if self.comm.rank == 0:
+            os.makedirs(output_dir, exist_ok=True)
+        self.comm.barrier()
+
+        if fmt == "xdmf":
+            self.targets = []
+            for func in self.fields:
+                el = basix_element("Lagrange", domain.topology.cell_name(), 1,
+                                   shape=tuple(func.ufl_shape) or None)
+                self.targets.append(fem.Function(fem.functionspace(domain, el), name=func.name))
+            self.files = [dolfinx.io.XDMFFile(self.comm, f"{output_dir}/solution{suffix}.xdmf", "w",
+                                              encoding=dolfinx.io.XDMFFile.Encoding.HDF5)]
+            self.files[0].write_mesh(domain)
+        elif fmt == "vtx":
+            self.targets = self.fields
+            self.files = []
+            for func in self.fields:
+                path = f"{output_dir}/{func.name}{suffix}.bp"
+                try:
+                    writer = dolfinx.io.VTXWriter(self.comm, path, [func], engine=engine,
+                                                  mesh_policy=dolfinx.io.VTXMeshPolicy.reuse)
+                except (TypeError, AttributeError):
+                    writer = dolfinx.io.VTXWriter(self.comm, path, [func], engine=engine)
+                self.files.append(writer)
+        else:
+            raise ValueError(f"Unknown output format '{fmt}' (expected 'xdmf' or 'vtx')")
+
+    def write(self, t):
+        """Append all fields at time t"""
+        if self.fmt == "xdmf":
+            for func, target in zip(self.fields, self.targets):
+                target.interpolate(func)
+                self.files[0].write_function(target, t)
+        else:
+            for writer in self.files:
+                writer.write(t)
+
+    def close(self):
+        for f in self.files:
+            f.close()
 
-    # Connectivity: build quadrilaterals split into two triangles
-    nx = len(x_coords) - 1
-    row = len(x_coords)
-    cells = []
-    for j in range(ny):
-        for i in range(nx):
-            # node indices
-            n0 = j * row + i
-            n1 = n0 + 1
-            n2 = n0 + row
-            n3 = n2 + 1
-            # two triangles: (n0, n2, n3) and (n0, n3, n1)
-            cells.append([n0, n2, n3])
-            cells.append([n0, n3, n1])
-
-    cells = np.array(cells, dtype=np.int64)
 
-    # Define the P1 Lagrange element for the coordinates.
-    cell_type = dmesh.CellType.triangle
-    coord_element = basix_element("Lagrange", cell_type.name, 1, shape=(3,))
-    
-    # Create DOLFINx mesh, passing the coordinate element
-    domain = dmesh.create_mesh(comm, cells, points, coord_element)
-    
-    return domain
+# ------------------------------
+# Scalar diagnostics
+# ------------------------------
+class ScalarDiagnostics:
+    """
+    Scalar functionals (mass, boundary and interface fluxes) of the solution,
+    from forms compiled once and assembled per call.
+    - the local values of all forms are reduced in a single allreduce, so every
+      rank gets the global values
+    - rows (step, t, values) are streamed by rank 0 to CSV, or to a JSON array
+      (closed by close()) for a .json path, one flushed row per write
+    """
 
-def top_boundary(x):
-    """Locate top boundary (y=1)"""
-    return np.isclose(x[1], 1.0)
+    def __init__(self, comm, forms, path=None):
+        self.comm = comm
+        self.names = list(forms)
+        self.forms = [forms[name] for name in self.names]
+        self.path = path
+        self.file = None
+        self.num_rows = 0
+        if path is not None and comm.rank == 0:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.file = open(path, "w")
+            if path.endswith(".json"):
+                self.file.write("[")
+            else:
+                self.file.write(",".join(["step", "t"] + self.names) + "\n")
+
+    def evaluate(self):
+        """Global values {name: value} (collective)"""
+        local = np.array([fem.assemble_scalar(form) for form in self.forms], dtype=np.float64)
+        return dict(zip(self.names, self.comm.allreduce(local, op=MPI.SUM)))
+
+    def write(self, step, t):
+        """Evaluate, append a row and return the values (collective)"""
+        values = self.evaluate()
+        if self.file is not None:
+            if self.path.endswith(".json"):
+                row = {"step": step, "t": t, **{name: float(v) for name, v in values.items()}}
+                self.file.write(("," if self.num_rows else "") + "\n  " + json.dumps(row))
+            else:
+                self.file.write(",".join([str(step), repr(float(t))] + [repr(float(v)) for v in values.values()])
+                                + "\n")
+            self.file.flush()
+        self.num_rows += 1
+        return values
+
+    def close(self):
+        if self.file is not None:
+            if self.path.endswith(".json"):
+                self.file.write("\n]\n")
+            self.file.close()
+            self.file = None
 
-# Create mesh
-print(f"[{datetime.now().isoformat()}] Creating layered mesh...")
-mesh_domain = create_layered_structured_mesh(comm, ny=40, n_anode=20, n_mem=120, n_cathode=20)
-print(f"  Mesh has {mesh_domain.topology.index_map(2).size_local} cells")
 
 # ------------------------------
-# Tag cells into regions by centroid x-coordinate
+# Checkpoint/restart
 # ------------------------------
-topology = mesh_domain.topology
-tdim = mesh_domain.topology.dim
-tdim_minus_1 = tdim - 1
+class Checkpointer:
+    """
+    Parallel checkpoints of named Functions plus run metadata.
+    - directory/step_NNNNNN/rank_R.npz: every Function's local array (owned
+      + ghosts) and the global indices of its owned DOFs, one file per rank
+    - meta.json (rank 0) is written once all ranks have finished, then the
+      'latest' file is updated; a run killed mid-write resumes from the
+      previous complete checkpoint
+    - Restarting needs the same rank count and mesh/space settings (the mesh
+      partition is then identical); load() checks the stored DOF indices
+    """
 
-# Compute cell centroids
-geometry = mesh_domain.geometry.x
-cells = mesh_domain.topology.connectivity(tdim, 0).array.reshape((-1, 3))
-cell_coords = np.mean(geometry[cells], axis=1)  # shape (n_cells, 3)
-cell_x = cell_coords[:, 0]
+    def __init__(self, comm, directory="checkpoints", keep=2):
+        self.comm = comm
+        self.directory = directory
+        self.keep = keep
+        if comm.rank == 0:
+            os.makedirs(directory, exist_ok=True)
+        comm.barrier()
+
+    @staticmethod
+    def _owned_global_indices(func):
+        index_map = func.function_space.dofmap.index_map
+        return index_map.local_to_global(np.arange(index_map.size_local, dtype=np.int32))
+
+    def save(self, step, functions, meta):
+        """Write a checkpoint (collective); returns its path"""
+        import shutil
+
+        path = os.path.join(self.directory, f"step_{step:06d}")
+        if self.comm.rank == 0:
+            os.makedirs(path, exist_ok=True)
+        self.comm.barrier()
+        arrays = {}
+        for name, func in functions.items():
+            arrays[f"{name}/values"] = func.x.array
+            arrays[f"{name}/dofs"] = self._owned_global_indices(func)
+        np.savez(os.path.join(path, f"rank_{self.comm.rank}.npz"), **arrays)
+        self.comm.barrier()
+
+        if self.comm.rank == 0:
+            with open(os.path.join(path, "meta.json"), "w") as f:
+                json.dump(dict(meta, step=step, ranks=self.comm.size, functions=list(functions)), f, indent=2)
+            with open(os.path.join(self.directory, "latest"), "w") as f:
+                f.write(os.path.basename(path))
+            checkpoints = sorted(d for d in os.listdir(self.directory) if d.startswith("step_"))
+            for old in checkpoints[:-self.keep] if self.keep else []:
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+        self.comm.barrier()
+        return path
+
+    def latest(self):
+        """Path of the newest complete checkpoint, or None"""
+        path = None
+        if self.comm.rank == 0:
+            try:
+                with open(os.path.join(self.directory, "latest")) as f:
+                    path = os.path.join(self.directory, f.read().strip())
+            except FileNotFoundError:
+                pass
+        return self.comm.bcast(path, root=0)
+
+    def load(self, path, functions):
+        """Restore the named Functions stored in a checkpoint and return its metadata"""
+        meta = None
+        if self.comm.rank == 0:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+        meta = self.comm.bcast(meta, root=0)
+        if meta["ranks"] != self.comm.size:
+            raise RuntimeError(f"Checkpoint {path} was written on {meta['ranks']} rank(s), "
+                               f"restart with the same count (running on {self.comm.size})")
+
+        data = np.load(os.path.join(path, f"rank_{self.comm.rank}.npz"))
+        ok = True
+        for name, func in functions.items():
+            if f"{name}/dofs" not in data.files:
+                continue
+            dofs = data[f"{name}/dofs"]
+            ok &= np.array_equal(dofs, self._owned_global_indices(func))
+            if ok:
+                func.x.array[:] = data[f"{name}/values"]
+                func.x.scatter_forward()
+        if not self.comm.allreduce(ok, op=MPI.LAND):
+            raise RuntimeError(f"Checkpoint {path} does not match this mesh/partition "
+                               "(mesh size, cell type or degree changed?)")
+        return meta
 
-# Create markers: 1->anode, 2->membrane, 3->cathode
-tags = np.zeros(cell_x.shape[0], dtype=np.int32)
-tags[cell_x <= 0.4] = 1
-tags[(cell_x > 0.4) & (cell_x <= 0.6)] = 2
-tags[cell_x > 0.6] = 3
 
-# Create MeshTags for cells
-cell_indices = np.arange(len(tags), dtype=np.int32)
-mt = meshtags(mesh_domain, tdim, cell_indices, tags)
+# ------------------------------
+# Performance instrumentation
+# ------------------------------
+class PerformanceReport:
+    """
+    Per-phase wall time and memory, plus per-step KSP statistics.
+    - phase(name) accumulates calls, wall time, rss_delta_mb (largest
+      exit-minus-entry RSS) and phase_peak_rss_mb (largest RSS reached inside
+      the phase, transient peaks included)
+    - on Linux the kernel's RSS high-water mark is reset at phase entry
+      (/proc/self/clear_refs) and read at exit (VmHWM); elsewhere the phase
+      peak falls back to max(entry, exit) RSS (peak_rss_method says which)
+    - record_ksp() logs iterations, residual norm and convergence reason
+    - with petsc_stages=True each phase is also a PETSc log stage, so
+      -log_view breaks the PETSc events down by phase
+    """
+
+    def __init__(self, comm, petsc_stages=False):
+        self.comm = comm
+        self.petsc_stages = petsc_stages
+        self.phases = {}
+        self.ksp_log = []
+        self._stages = {}
+        self._process = psutil.Process()
+        # Peaks of the enclosing phases, innermost last (a nested phase resets the high-water mark)
+        self._peak_stack = []
+        # The reset also lowers ru_maxrss, so the process peak is tracked here
+        self.process_peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        self.peak_rss_method = "vmhwm" if self._reset_hwm() else "entry_exit"
+
+    @staticmethod
+    def _reset_hwm():
+        """Reset the RSS high-water mark (Linux); False where unsupported"""
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _read_hwm_mb():
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+        return 0.0
+
+    def _phase_peak_mb(self, rss_mb):
+        """High-water RSS since the last reset (or the current RSS without /proc)"""
+        peak = self._read_hwm_mb() if self.peak_rss_method == "vmhwm" else rss_mb
+        self.process_peak_mb = max(self.process_peak_mb, peak)
+        return peak
+
+    @contextmanager
+    def phase(self, name, exclude=()):
+        """
+        Time (and track memory of) the enclosed block under name; the time of
+        the phases in exclude entered inside it is not counted again
+        """
+        entry = self.phases.setdefault(
+            name, {"calls": 0, "time_s": 0.0, "rss_delta_mb": 0.0, "phase_peak_rss_mb": 0.0})
+        stage = None
+        if self.petsc_stages:
+            stage = self._stages.setdefault(name, PETSc.Log.Stage(name))
+            stage.push()
+        rss_before = self._process.memory_info().rss / 1024.0**2
+        if self._peak_stack:
+            # Fold the enclosing phase's peak so far in before the reset
+            self._peak_stack[-1] = max(self._peak_stack[-1], self._phase_peak_mb(rss_before))
+        if self.peak_rss_method == "vmhwm":
+            self._reset_hwm()
+        self._peak_stack.append(rss_before)
+        excluded_before = sum(self.time(nested) for nested in exclude)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            entry["time_s"] += elapsed - (sum(self.time(nested) for nested in exclude) - excluded_before)
+            entry["calls"] += 1
+            rss_after = self._process.memory_info().rss / 1024.0**2
+            peak = max(self._peak_stack.pop(), self._phase_peak_mb(rss_after))
+            if self._peak_stack:
+                self._peak_stack[-1] = max(self._peak_stack[-1], peak)
+            entry["rss_delta_mb"] = max(entry["rss_delta_mb"], rss_after - rss_before)
+            entry["phase_peak_rss_mb"] = max(entry["phase_peak_rss_mb"], peak)
+            if stage is not None:
+                stage.pop()
+
+    def time(self, name):
+        return self.phases.get(name, {}).get("time_s", 0.0)
+
+    def record_ksp(self, step, solver, ksp, snes=None):
+        """Store (and return) the KSP (and SNES) statistics of the last solve"""
+        entry = {
+            "step": step,
+            "solver": solver,
+            "iterations": int(ksp.getIterationNumber()),
+            "residual_norm": float(ksp.getResidualNorm()),
+            "reason": int(ksp.getConvergedReason()),
+        }
+        if snes is not None:
+            # Linear iterations summed over all Newton iterations of the solve
+            entry.update(iterations=int(snes.getLinearSolveIterations()),
+                         nonlinear_iterations=int(snes.getIterationNumber()),
+                         residual_norm=float(snes.getFunctionNorm()),
+                         reason=int(snes.getConvergedReason()))
+        self.ksp_log.append(entry)
+        return entry
+
+    def summary(self):
+        """Phases reduced over ranks: max time, max RSS figures"""
+        names = sorted(set().union(*self.comm.allgather(list(self.phases))))
+        phases = {}
+        for name in names:
+            entry = self.phases.get(name, {"calls": 0, "time_s": 0.0, "rss_delta_mb": 0.0,
+                                           "phase_peak_rss_mb": 0.0})
+            phases[name] = {key: self.comm.allreduce(entry[key], op=MPI.MAX)
+                            for key in ("calls", "time_s", "rss_delta_mb", "phase_peak_rss_mb")}
+        return phases
+
+    def write_json(self, path, extra=None):
+        """Write the reduced report (collective; rank 0 writes)"""
+        report = {
+            "ranks": self.comm.size,
+            "created": datetime.now().isoformat(),
+            "phases": self.summary(),
+            "ksp": self.ksp_log,
+            "peak_rss_method": self.peak_rss_method,
+            "peak_rss_mb": self.comm.allreduce(
+                max(self.process_peak_mb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                    self._phase_peak_mb(self._process.memory_info().rss / 1024.0**2)), op=MPI.MAX),
+        }
+        report.update(extra or {})
+        if self.comm.rank == 0:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+        return report
 
 
 # ------------------------------
-# Tag facets (boundaries) for BCs: Anode Top (1), Membrane Top (2), Cathode Top (3)
-# (RE-IMPLEMENTED CORRECT REGION-SPECIFIC TAGGING)
+# Persistent linear solvers
 # ------------------------------
+def create_configured_ksp(comm, A, petsc_options, prefix):
+    """Create a KSP on A configured from petsc_options under an options prefix"""
+    ksp = PETSc.KSP().create(comm)
+    ksp.setOperators(A)
+    ksp.setOptionsPrefix(prefix)
+    opts = PETSc.Options()
+    opts.prefixPush(prefix)
+    for key, value in petsc_options.items():
+        opts[key] = value
+    opts.prefixPop()
+    ksp.setFromOptions()
+    A.setOptionsPrefix(prefix)
+    A.setFromOptions()
+    return ksp
+
+
+def parallel_pc_options(petsc_options, ranks):
+    """
+    petsc_options usable on this many ranks: on more than one, a (serial-only)
+    ILU preconditioner becomes block Jacobi with ILU(k) on each rank's block
+    """
+    if ranks == 1 or petsc_options.get("pc_type") != "ilu":
+        return petsc_options
+    options = {key: value for key, value in petsc_options.items() if not key.startswith("pc_factor_")}
+    options.update({"pc_type": "bjacobi", "sub_pc_type": "ilu"})
+    for key, value in petsc_options.items():
+        if key.startswith("pc_factor_"):
+            options[f"sub_{key}"] = value
+    return options
+
+
+def assemble_rhs(b, a, L, bcs):
+    """Assemble L into b with lifting and Dirichlet values (as LinearProblem does)"""
+    with b.localForm() as b_loc:
+        b_loc.set(0)
+    assemble_vector(b, L)
+    apply_lifting(b, [a], bcs=[bcs])
+    b.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
+    set_bc(b, bcs)
+
+
+class InitialGuess:
+    """
+    Initial guess for repeated solves of one unknown from its earlier solutions.
+    - "zero": start from zero (KSP default)
+    - "previous": the last solution
+    - "extrapolate": linear extrapolation 2 u_n - u_(n-1)
+    - "projection": least-squares fit of b in span(A u_i) over the last
+      basis_size solutions; A u_i are kept until the operator changes
+    """
 
-# 1. Locate all facets on the top boundary (y=1)
-top_facets = locate_entities_boundary(mesh_domain, tdim_minus_1, top_boundary)
+    POLICIES = {"zero": 0, "previous": 1, "extrapolate": 2, "projection": None}
+
+    def __init__(self, policy="previous", basis_size=4):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown initial guess policy '{policy}'")
+        self.policy = policy
+        self.keep = self.POLICIES[policy] if self.POLICIES[policy] is not None else basis_size
+        self.history = []  # oldest first
+        self.images = []   # A @ history[i] for the first len(images) entries
+
+    def operator_changed(self):
+        for w in self.images:
+            w.destroy()
+        self.images = []
+
+    def apply(self, A, b, x):
+        """Write the guess into x; returns False (x zeroed) when there is none"""
+        history = self.history
+        if not history:
+            x.set(0.0)
+            return False
+        if self.policy == "previous" or len(history) == 1:
+            history[-1].copy(x)
+        elif self.policy == "extrapolate":
+            history[-1].copy(x)
+            x.scale(2.0)
+            x.axpy(-1.0, history[-2])
+        else:
+            while len(self.images) < len(history):
+                w = A.createVecLeft()
+                A.mult(history[len(self.images)], w)
+                self.images.append(w)
+            gram = np.array([[wi.dot(wj) for wj in self.images] for wi in self.images])
+            rhs = np.array([wi.dot(b) for wi in self.images])
+            coeffs = np.linalg.lstsq(gram, rhs, rcond=None)[0]
+            x.set(0.0)
+            for coeff, v in zip(coeffs, history):
+                x.axpy(coeff, v)
+        return True
+
+    def record(self, x):
+        """Remember the solution x for the next guess"""
+        if self.keep == 0:
+            return
+        if len(self.history) == self.keep:
+            self.history.pop(0).destroy()
+            if self.images:
+                self.images.pop(0).destroy()
+        self.history.append(x.copy())
+
+    def destroy(self):
+        self.operator_changed()
+        for v in self.history:
+            v.destroy()
+        self.history = []
+
+
+class SpeciesSolver:
+    """
+    Linear species solver that keeps A, the KSP and its preconditioner alive
+    across time steps.
+    - A is assembled (and the PC set up) once; each step only reassembles L,
+      applies lifting and sets the Dirichlet values
+    - The operator is reassembled when dt_const or Phi change (auto_reassemble)
+      or after an explicit mark_operator_dirty()
+    - The KSP starts from an InitialGuess built from earlier solutions
+    - With split = (M, K), a = M/dt + K: M and K are assembled once (and K
+      again when Phi changes) and a dt change only recombines A = K + M/dt
+    """
 
-# 2. Get the midpoints of these facets to check their x-coordinates
-facet_indices = top_facets
-all_facet_midpoints = dolfinx.mesh.compute_midpoints(mesh_domain, tdim_minus_1, facet_indices)
+    def __init__(self, a, L, bcs, u, petsc_options, dt_const=None, Phi=None,
+                 auto_reassemble=True, prefix="species_", report=None,
+                 initial_guess="zero", guess_basis=4, split=None):
+        self.a = a
+        self.L = L
+        self.bcs = bcs
+        self.u = u
+        self.dt_const = dt_const
+        self.Phi = Phi
+        self.auto_reassemble = auto_reassemble
+
+        self.A = create_matrix(a)
+        self.b = create_vector(L)
+        self.ksp = create_configured_ksp(u.function_space.mesh.comm, self.A, petsc_options, prefix)
+        self.report = report or PerformanceReport(u.function_space.mesh.comm)
+
+        self.initial_guess = initial_guess
+        self.guess_basis = guess_basis
+        self.guesses = [InitialGuess(initial_guess, guess_basis)]
+
+        self.split = split
+        self.M = self.K = None
+        if split is not None:
+            self.M = create_matrix(split[0])
+            self.K = create_matrix(split[1])
+
+        self._operator_dirty = True
+        self._dt_seen = None
+        self._phi_seen = None
+        self.num_assemblies = 0
+        self.num_dt_updates = 0
+
+    def mark_operator_dirty(self):
+        """Force reassembly of A (and PC setup) on the next solve"""
+        self._operator_dirty = True
+
+    def _coefficients_changed(self):
+        """Check whether dt_const or Phi differ from the last assembled state"""
+        if self.dt_const is not None and float(self.dt_const.value) != self._dt_seen:
+            return True
+        return self._phi_changed()
+
+    def assemble_operator(self):
+        """Assemble A with the Dirichlet rows and remember the coefficient state"""
+        if self.split is not None and not self._operator_dirty and not self._phi_changed():
+            self.combine_split_operator()
+            return
+        if self.split is not None:
+            # Dirichlet rows: K carries the unit diagonal, M zeros
+            for mat, form, diagonal in ((self.M, self.split[0], 0.0), (self.K, self.split[1], 1.0)):
+                mat.zeroEntries()
+                assemble_matrix(mat, form, bcs=self.bcs, diagonal=diagonal)
+                mat.assemble()
+            self.combine_split_operator(count=False)
+        else:
+            self.A.zeroEntries()
+            assemble_matrix(self.A, self.a, bcs=self.bcs)
+            self.A.assemble()
+        # Re-attaching the operator makes the KSP rebuild the preconditioner
+        self.ksp.setOperators(self.A)
+        for guess in self.guesses:
+            guess.operator_changed()
+
+        if self.dt_const is not None:
+            self._dt_seen = float(self.dt_const.value)
+        if self.Phi is not None:
+            self._phi_seen = self.Phi.x.array.copy()
+        self._operator_dirty = False
+        self.num_assemblies += 1
+
+    def _phi_changed(self):
+        return self.Phi is not None and (
+            self._phi_seen is None or not np.array_equal(self.Phi.x.array, self._phi_seen))
+
+    def combine_split_operator(self, count=True):
+        """A = K + M/dt from the stored M and K (no form assembly)"""
+        subset = PETSc.Mat.Structure.SUBSET_NONZERO_PATTERN
+        self.A.zeroEntries()
+        self.A.axpy(1.0, self.K, structure=subset)
+        self.A.axpy(1.0 / float(self.dt_const.value), self.M, structure=subset)
+        self.ksp.setOperators(self.A)
+        for guess in self.guesses:
+            guess.operator_changed()
+        self._dt_seen = float(self.dt_const.value)
+        if count:
+            self.num_dt_updates += 1
+
+    def solve(self):
+        """Assemble the RHS, solve in-place into u and return u"""
+        with self.report.phase("species_assembly"):
+            if self._operator_dirty or (self.auto_reassemble and self._coefficients_changed()):
+                self.assemble_operator()
+            assemble_rhs(self.b, self.a, self.L, self.bcs)
+
+        with self.report.phase("species_solve"):
+            guess = self.guesses[0]
+            self.ksp.setInitialGuessNonzero(guess.apply(self.A, self.b, self.u.x.petsc_vec))
+            self.ksp.solve(self.b, self.u.x.petsc_vec)
+            guess.record(self.u.x.petsc_vec)
+            self.u.x.scatter_forward()
+        return self.u
+
+    def destroy(self):
+        for guess in self.guesses:
+            guess.destroy()
+        for mat in (self.M, self.K):
+            if mat is not None:
+                mat.destroy()
+        self.ksp.destroy()
+        self.A.destroy()
+        self.b.destroy()
+
+
+# KSP types whose KSPMatSolve solves all columns at once (others loop over KSPSolve)
+MATSOLVE_KSP_TYPES = ("preonly", "hpddm")
+
+
+class BatchedSpeciesSolver(SpeciesSolver):
+    """
+    One species operator shared by several species with identical coefficients.
+    - A and the preconditioner are set up once for the whole group: the
+      Dirichlet rows are the same for every species, only the values differ
+    - each species' RHS is assembled from its own c_n (copied into the form's
+      c_n coefficient) with its own Dirichlet values
+    - block=True solves all RHS together (KSPMatSolve on dense B -> X),
+      otherwise one KSP solve per species, reusing the same PC; block="auto"
+      picks the block solve only for MATSOLVE_KSP_TYPES
+    """
 
-# 3. Create arrays for tags
-ft_indices = []
-ft_values = []
+    def __init__(self, a, L, bcs_list, u_list, c_n_list, c_n_form, petsc_options,
+                 block="auto", **kwargs):
+        super().__init__(a, L, bcs_list[0], u_list[0], petsc_options, **kwargs)
+        self.bcs_list = bcs_list
+        self.u_list = u_list
+        self.c_n_list = c_n_list
+        self.c_n_form = c_n_form
+        self.b_list = [self.b] + [create_vector(L) for _ in u_list[1:]]
+        self.guesses = [InitialGuess(self.initial_guess, self.guess_basis) for _ in u_list]
+        if block == "auto":
+            block = petsc_options.get("ksp_type") in MATSOLVE_KSP_TYPES
+        self.block = bool(block) and len(u_list) > 1
+        self.B = self.X = None
+        if self.block:
+            comm = u_list[0].function_space.mesh.comm
+            sizes = [self.b.getSizes(), (PETSc.DECIDE, len(u_list))]
+            self.B = PETSc.Mat().createDense(sizes, comm=comm)
+            self.B.setUp()
+            self.X = PETSc.Mat().createDense(sizes, comm=comm)
+            self.X.setUp()
+
+    def solve(self):
+        """Assemble every species' RHS, solve in-place into u_list and return it"""
+        with self.report.phase("species_assembly"):
+            if self._operator_dirty or (self.auto_reassemble and self._coefficients_changed()):
+                self.assemble_operator()
+            for b, bcs, c_n in zip(self.b_list, self.bcs_list, self.c_n_list):
+                if c_n is not self.c_n_form:
+                    self.c_n_form.x.array[:] = c_n.x.array
+                assemble_rhs(b, self.a, self.L, bcs)
+
+        with self.report.phase("species_solve"):
+            has_guess = [guess.apply(self.A, b, u.x.petsc_vec)
+                         for guess, b, u in zip(self.guesses, self.b_list, self.u_list)]
+            if self.block:
+                B = self.B.getDenseArray(readonly=False)
+                X = self.X.getDenseArray(readonly=False)
+                for j, (b, u) in enumerate(zip(self.b_list, self.u_list)):
+                    B[:, j] = b.array_r
+                    X[:, j] = u.x.petsc_vec.array_r
+                self.B.assemble()
+                self.X.assemble()
+                self.ksp.setInitialGuessNonzero(any(has_guess))
+                self.ksp.matSolve(self.B, self.X)
+                X = self.X.getDenseArray(readonly=True)
+                for j, u in enumerate(self.u_list):
+                    u.x.petsc_vec.array[:] = X[:, j]
+            else:
+                for b, u, nonzero in zip(self.b_list, self.u_list, has_guess):
+                    self.ksp.setInitialGuessNonzero(nonzero)
+                    self.ksp.solve(b, u.x.petsc_vec)
+            for guess, u in zip(self.guesses, self.u_list):
+                guess.record(u.x.petsc_vec)
+                u.x.scatter_forward()
+        return self.u_list
+
+    def destroy(self):
+        for b in self.b_list[1:]:
+            b.destroy()
+        for mat in (self.B, self.X):
+            if mat is not None:
+                mat.destroy()
+        super().destroy()
+
+
+class NonlinearSpeciesSolver:
+    """
+    Newton (PETSc SNES) solve of a species residual F(u) = 0 with Jacobian J.
+    - the KSP/PC options and the snes_* options share one options prefix, so
+      snes_lag_jacobian / snes_lag_preconditioner (and *_persists to carry
+      the lag across time steps) skip Jacobian assembly / PC setup
+    - a dt_const change or mark_operator_dirty() forces a fresh Jacobian and
+      PC on the next solve (lag -2 for that solve), whatever the lag
+    - Dirichlet rows hold u - g in F (lifting with x0 = u, as NonlinearProblem)
+    """
 
-# Loop through top facets and assign tags based on x-coordinate
-for i, facet_index in enumerate(facet_indices):
-    midpoint_x = all_facet_midpoints[i, 0]
-    
-    if midpoint_x <= 0.4:
-        # Anode Top -> Tag 1 (Outflow)
-        ft_indices.append(facet_index)
-        ft_values.append(1)
-    elif midpoint_x > 0.6:
-        # Cathode Top -> Tag 3 (Outflow)
-        ft_indices.append(facet_index)
-        ft_values.append(3)
-    else:
-        # Membrane Top -> Tag 2 (No Outflow BC)
-        ft_indices.append(facet_index)
-        ft_values.append(2)
+    def __init__(self, F, J, bcs, u, petsc_options, snes_options, dt_const=None, prefix="species_",
+                 report=None):
+        self.F = F
+        self.J = J
+        self.bcs = bcs
+        self.u = u
+        self.dt_const = dt_const
+        comm = u.function_space.mesh.comm
+        self.report = report or PerformanceReport(comm)
+
+        self.A = create_matrix(J)
+        self.b = create_vector(F)
+        self.x = u.x.petsc_vec.copy()
+        self.snes = PETSc.SNES().create(comm)
+        self.snes.setFunction(self._residual, self.b)
+        self.snes.setJacobian(self._jacobian, self.A)
+        self.snes.setOptionsPrefix(prefix)
+        opts = PETSc.Options()
+        opts.prefixPush(prefix)
+        for key, value in {**petsc_options, **snes_options}.items():
+            opts[key] = value
+        opts.prefixPop()
+        self.snes.setFromOptions()
+        self.A.setOptionsPrefix(prefix)
+        self.A.setFromOptions()
+        self.ksp = self.snes.getKSP()
+        self.lag_jacobian = self.snes.getLagJacobian()
+        self.lag_preconditioner = self.snes.getLagPreconditioner()
+        self._operator_dirty = False
+        self._dt_seen = float(dt_const.value) if dt_const is not None else None
+        self.num_assemblies = 0
+        self.num_dt_updates = 0
+        self.guesses = []
+
+    def _residual(self, snes, x, b):
+        x.ghostUpdate(addv=PETSc.InsertMode.INSERT, mode=PETSc.ScatterMode.FORWARD)
+        x.copy(self.u.x.petsc_vec)
+        self.u.x.scatter_forward()
+        with self.report.phase("species_assembly"):
+            with b.localForm() as b_loc:
+                b_loc.set(0)
+            assemble_vector(b, self.F)
+            apply_lifting(b, [self.J], bcs=[self.bcs], x0=[x], alpha=-1.0)
+            b.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
+            set_bc(b, self.bcs, x, -1.0)
+
+    def _jacobian(self, snes, x, A, P):
+        with self.report.phase("species_assembly"):
+            A.zeroEntries()
+            assemble_matrix(A, self.J, bcs=self.bcs)
+            A.assemble()
+        self.num_assemblies += 1
+
+    def mark_operator_dirty(self):
+        """Force a new Jacobian (and PC setup) on the next solve, whatever the lag"""
+        self._operator_dirty = True
+
+    def _check_dt(self):
+        """A changed dt_const makes a lagged Jacobian / PC stale"""
+        if self.dt_const is not None and float(self.dt_const.value) != self._dt_seen:
+            self._dt_seen = float(self.dt_const.value)
+            self.num_dt_updates += 1
+            self._operator_dirty = True
+
+    def solve(self):
+        """Newton solve from the current u (the previous step), in-place into u"""
+        self._check_dt()
+        rebuild = self._operator_dirty
+        if rebuild:
+            # -2: rebuild at the next Newton iteration; the configured lags are restored below
+            self.snes.setLagJacobian(-2)
+            self.snes.setLagPreconditioner(-2)
+        # The F/J assemblies inside SNES are timed as species_assembly, not twice
+        try:
+            with self.report.phase("species_solve", exclude=("species_assembly",)):
+                self.u.x.petsc_vec.copy(self.x)
+                self.snes.solve(None, self.x)
+                self.x.copy(self.u.x.petsc_vec)
+                self.u.x.scatter_forward()
+        finally:
+            if rebuild:
+                self.snes.setLagJacobian(self.lag_jacobian)
+                self.snes.setLagPreconditioner(self.lag_preconditioner)
+                self._operator_dirty = False
+        return self.u
+
+    def destroy(self):
+        self.snes.destroy()
+        self.A.destroy()
+        self.b.destroy()
+        self.x.destroy()
+
+
+class DarcyStage:
+    """
+    Stationary Darcy solve with a cached solution and LU factorization.
+    - The first update() assembles, factorizes (preonly + LU) and solves
+    - Later updates reuse the stored solution while the forms, BCs and the
+      watched fem.Constant values are unchanged
+    - solve_every=N re-solves every N steps (for varying coefficients); with
+      reuse_factorization=True these re-solves only reassemble L and reuse
+      the stored LU factors, otherwise A is reassembled and refactorized
+    """
 
-# Convert to numpy arrays
-ft_indices = np.array(ft_indices, dtype=np.int32)
-ft_values = np.array(ft_values, dtype=np.int32)
+    def __init__(self, a, L, bcs, u, petsc_options, solve_every=0,
+                 reuse_factorization=False, watch=(), prefix="darcy_", report=None):
+        self.a = a
+        self.L = L
+        self.bcs = bcs
+        self.u = u
+        self.solve_every = solve_every
+        self.reuse_factorization = reuse_factorization
+        self.watch = list(watch)
+
+        self.A = create_matrix(a)
+        self.b = create_vector(L)
+        self.ksp = create_configured_ksp(u.function_space.mesh.comm, self.A, petsc_options, prefix)
+        self.report = report or PerformanceReport(u.function_space.mesh.comm)
+
+        self._solved_signature = None
+        self.num_factorizations = 0
+        self.num_solves = 0
+
+    def _signature(self):
+        """Identity of forms and BCs plus the values of the watched constants"""
+        return (
+            id(self.a), id(self.L), tuple(id(bc) for bc in self.bcs),
+            tuple(np.asarray(const.value).tobytes() for const in self.watch),
+        )
+
+    def mark_solved(self):
+        """Treat the current contents of u as the solution (e.g. restored from a checkpoint)"""
+        self._solved_signature = self._signature()
+
+    def needs_solve(self, step):
+        if self._solved_signature is None or self._signature() != self._solved_signature:
+            return True
+        return bool(self.solve_every) and step % self.solve_every == 0
+
+    def _factorize(self):
+        self.A.zeroEntries()
+        assemble_matrix(self.A, self.a, bcs=self.bcs)
+        self.A.assemble()
+        self.ksp.setOperators(self.A)
+        self.num_factorizations += 1
+
+    def update(self, step):
+        """Solve into u if the policy requires it; return True if a solve happened"""
+        if not self.needs_solve(step):
+            return False
+
+        signature = self._signature()
+        with self.report.phase("darcy_assembly"):
+            if signature != self._solved_signature or not self.reuse_factorization:
+                self._factorize()
+            assemble_rhs(self.b, self.a, self.L, self.bcs)
+
+        # The LU factorization itself happens in the first solve after _factorize
+        with self.report.phase("darcy_solve"):
+            self.ksp.solve(self.b, self.u.x.petsc_vec)
+            self.u.x.scatter_forward()
+        self._solved_signature = signature
+        self.num_solves += 1
+        return True
+
+    def destroy(self):
+        self.ksp.destroy()
+        self.A.destroy()
+        self.b.destroy()
 
-# Sort indices to ensure MeshTags are valid (required by dolfinx)
-sort_order = np.argsort(ft_indices)
-ft_indices = ft_indices[sort_order]
-ft_values = ft_values[sort_order]
 
-# Create the MeshTags object
-ft = meshtags(mesh_domain, tdim_minus_1, ft_indices, ft_values)
+# ------------------------------
+# Simulation parameters & constants (defaults)
+# ------------------------------
+DEFAULT_CONFIG = {
+    # Mesh: anode/membrane/cathode columns, rows (ny is multiplied by mesh_scale)
+    "ny": 40,
+    "n_anode": 20,
+    "n_mem": 120,
+    "n_cathode": 20,
+    "mesh_scale": 1,
+    "cell_type": "triangle",  # "triangle" (split quads) or "quadrilateral"
+    "degree": 3,              # Lagrange degree of the concentration space
+
+    # Temporal parameters
+    "T": 30.0,        # Total simulation time [s]
+    "num_steps": 5,   # Number of timesteps (initial dt = T/num_steps when adaptive)
+
+    # Adaptive time stepping (backward Euler step doubling): a step is accepted when
+    # the relative difference of one dt step and two dt/2 steps is below dt_tol;
+    # dt then scales by dt_safety*sqrt(dt_tol/err), clipped to [dt_shrink, dt_grow]
+    # and [dt_min, dt_max] (None: dt0/1000 and T)
+    "adaptive_dt": False,
+    "dt_tol": 1e-4,
+    "dt_safety": 0.9,
+    "dt_shrink": 0.2,
+    "dt_grow": 2.0,
+    "dt_min": None,
+    "dt_max": None,
+    # Stop once max over species of ||c - c_n|| / ||c_n|| drops below this (None: off)
+    "steady_tol": None,
+
+    # Species (ions): initial concentration per region and Dirichlet value on the
+    # anode/cathode bottoms and membrane interfaces; an optional per-species
+    # "region_constants" overrides the shared constants below
+    "species": {
+        "Na+": {"initial": {"anode": 0.54, "membrane": 0.54, "cathode": 1.0},
+                "boundary": {"anode": 0.54, "cathode": 1.0}},
+    },
+    # "batched": species with identical region constants share one operator and
+    # PC, "separate": one solver per species. species_block_solve solves a
+    # group's right-hand sides together (KSPMatSolve) instead of one by one;
+    # "auto" does so only for KSP types with a native block solve (preonly,
+    # hpddm), as KSPMatSolve otherwise runs one KSPSolve per column and only
+    # adds the dense copies
+    "species_solve": "batched",
+    "species_block_solve": "auto",
+    # Species KSP initial guess: "zero", "previous", "extrapolate" (2 c_n - c_(n-1))
+    # or "projection" onto the last species_guess_basis solutions
+    "species_initial_guess": "previous",
+    "species_guess_basis": 4,
+
+    # Region-specific constants for species transport
+    "region_constants": {
+        "anode":    {"Pe": 100.0,    "gamma": 1.0, "Ri": 0.0},
+        "membrane": {"Pe": 100.0, "gamma": 1.0,    "Ri": 0.0},
+        "cathode":  {"Pe": 100.0,    "gamma": 1.0, "Ri": 0.0},
+    },
+
+    # Global species parameters
+    "z_i_c": 1.0,     # valence of Na+ ion
+    "Pe_max": 100.0,  # Using Pe as Pe_max for migration in the stabilization term (from user's equation)
+
+    # SUPG tau: "expression" (UFL coth at every quadrature point) or "cellwise"
+    # (precomputed per cell into a DG0 Function with an overflow-free coth)
+    "supg_tau": "expression",
+
+    # Species-form terms that may be pruned when built: "auto" drops a term whose
+    # coefficient is known to vanish (Phi == 0, Hessian of a P1 Phi on simplices,
+    # Ri == 0), True keeps it (e.g. when a nonzero Phi is supplied), False drops it
+    "physics_terms": {
+        "migration": "auto",          # a_mig_b and a_mig_c
+        "migration_hessian": "auto",  # a_mig_c only
+        "source": "auto",             # L_source and Ri in the SUPG residual
+    },
+
+    # Quadrature degree per species-form term (None -> UFL's estimate)
+    "quadrature_degree": {
+        "time": None,       # mass and source terms
+        "diffusion": None,
+        "migration": None,
+        "advection": None,
+        "supg": None,       # a_stab, L_stab
+        "outflow": None,    # ds(1) + ds(3) penalty
+    },
+
+    # Darcy parameters (for membrane region)
+    "Re_val": 100.0,  # Reynolds number
+    "Da_val": 1e-5,   # Darcy number
+
+    # Species solve: "linear" (frozen Phi, operator reused) or "newton" (SNES on the
+    # residual F(c) = a(c; c) - L, with Phi + phi_coupling * c in the migration terms;
+    # the coupling is always in the Newton forms, so sweeps may change it)
+    "species_solver": "linear",
+    "phi_coupling": 0.0,
+    "snes_options": {
+        "snes_type": "newtonls",
+        "snes_linesearch_type": "basic",
+        "snes_rtol": 1e-8,
+        "snes_atol": 1e-10,
+        "snes_max_it": 25,
+        "snes_lag_jacobian": 1,        # reassemble J every N Newton iterations (-2: next solve only)
+        "snes_lag_preconditioner": 1,  # rebuild the PC every N Jacobians
+        "snes_lag_jacobian_persists": False,        # carry the lags across time steps
+        "snes_lag_preconditioner_persists": False,
+    },
+
+    # Species KSP/PC selected by autotune-pc (replaces petsc_options when set)
+    "petsc_options_file": None,
+    # Block Jacobi with ILU per rank: plain ILU on one rank, and PETSc's ILU
+    # alone only handles sequential matrices
+    "petsc_options": {
+        "ksp_type": "gmres",
+        "pc_type": "bjacobi",
+        "sub_pc_type": "ilu",
+        "ksp_rtol": 1e-8,
+        "ksp_atol": 1e-10,
+        "ksp_max_it": 1000
+    },
+    # New PETSc options for the Darcy solve (uses Direct LU solver)
+    "darcy_petsc_options": {
+        "ksp_type": "preonly",         # Use only the preconditioner (i.e., direct solve)
+        "pc_type": "lu",               # LU factorization (Direct Solver)
+        "pc_factor_mat_solver_type": "mumps" # Use mumps or superlu_dist for the factorization
+    },
+    # Darcy solve policy: 0 -> solve once and reuse while forms/BCs are unchanged,
+    # N -> re-solve every N steps (e.g. when coefficients vary in time)
+    "darcy_solve_every": 0,
+    "darcy_reuse_factorization": True,  # periodic re-solves reuse the stored LU factors
+
+    # Time-series output: "xdmf" (XDMF/HDF5), "vtx" (ADIOS2 .bp) or None
+    "output_format": "xdmf",
+    "output_dir": "output",
+    "vtx_engine": "BP4",
+
+    # HTML snapshots (optional): render every viz_every steps in a background process
+    # pool, with at most viz_max_pending frames in flight (extra frames are dropped)
+    "viz_enabled": False,
+    "viz_async": True,
+    "viz_every": 1,
+    "viz_max_pending": 4,
+    "viz_workers": 1,
+
+    # Checkpoints (c_n of every species, Darcy solution, t, step, dt) every
+    # checkpoint_every steps (0: off), keeping the last checkpoint_keep;
+    # restart resumes from the latest checkpoint in checkpoint_dir
+    "checkpoint_every": 0,
+    "checkpoint_dir": "checkpoints",
+    "checkpoint_keep": 2,
+    "restart": False,
+
+    # Form compilation (FFCx/CFFI): jit_cache_dir is a persistent kernel cache that
+    # can be shared between jobs (None: DOLFINx default, ~/.cache/fenics);
+    # jit_options are passed to fem.form as-is (e.g. cffi_extra_compile_args)
+    "jit_cache_dir": None,
+    "jit_options": {},
+
+    # Scalar diagnostics per species (region mass, ds(1)/ds(3) outflow flux,
+    # membrane-interface flux) every diagnostics_every steps, streamed to
+    # diagnostics_file (.csv, or .json for a JSON array); None: off
+    "diagnostics_file": None,
+    "diagnostics_every": 1,
+
+    # Optional path for the per-phase timing breakdown (written by rank 0)
+    "timings_json": None,
+    # Full performance report (phases, RSS, KSP statistics per step) as JSON
+    "report_json": None,
+    # Push a PETSc log stage per phase (view with -log_view)
+    "petsc_log_stages": False,
+}
 
 
-# Create measures for each region
-dx = ufl.Measure("dx", domain=mesh_domain, subdomain_data=mt)
-ds = ufl.Measure("ds", domain=mesh_domain, subdomain_data=ft)
+def make_config(overrides=None, base=None):
+    """Deep copy of base (DEFAULT_CONFIG) with overrides applied (nested dicts are merged)"""
+    config = copy.deepcopy(DEFAULT_CONFIG if base is None else base)
+    for key, value in (overrides or {}).items():
+        if key not in config:
+            raise KeyError(f"Unknown configuration key '{key}'")
+        if isinstance(config[key], dict) and isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if isinstance(config[key].get(sub_key), dict) and isinstance(sub_value, dict):
+                    config[key][sub_key].update(sub_value)
+                else:
+                    config[key][sub_key] = sub_value
+        else:
+            config[key] = value
+    return config
 
-print(f"  Anode cells: {np.sum(tags == 1)}")
-print(f"  Membrane cells: {np.sum(tags == 2)}")
-print(f"  Cathode cells: {np.sum(tags == 3)}")
 
 # ------------------------------
-# Function spaces & initial conditions
+# MPI helpers
 # ------------------------------
-print(f"[{datetime.now().isoformat()}] Creating function spaces...")
-V = create_function_space_layered(mesh_domain, degree=3)  # P3 for concentration
+def global_count(comm, mask):
+    """Number of True entries of a rank-local (owned) mask, summed over ranks"""
+    return comm.allreduce(int(np.count_nonzero(mask)), op=MPI.SUM)
 
-# Initial concentration
-c_n = set_layered_initial_conditions(V, "Na+")
-c_n.x.scatter_forward()
 
-# Trial and test functions for species
-Ci = ufl.TrialFunction(V)
-w = ufl.TestFunction(V)
+def global_min_max(func):
+    """Min/max of a Function over owned DOFs (ghosts excluded), reduced over ranks"""
+    comm = func.function_space.mesh.comm
+    index_map = func.function_space.dofmap.index_map
+    owned = func.x.array[:index_map.size_local * func.function_space.dofmap.index_map_bs]
+    local_min = np.min(owned) if owned.size else np.inf
+    local_max = np.max(owned) if owned.size else -np.inf
+    return comm.allreduce(local_min, op=MPI.MIN), comm.allreduce(local_max, op=MPI.MAX)
+
 
 # ------------------------------
-# Setup Dirichlet boundary conditions
+# Build a non-uniform structured mesh
 # ------------------------------
-print(f"[{datetime.now().isoformat()}] Setting up boundary conditions...")
+def layered_coordinates(ny, n_anode, n_mem, n_cathode):
+    """Graded x coordinates (anode | membrane | cathode) and uniform y coordinates"""
+    x_anode = np.linspace(0.0, 0.4, n_anode + 1, endpoint=True)
+    x_mem = np.linspace(0.4, 0.6, n_mem + 1, endpoint=True)[1:]
+    x_cath = np.linspace(0.6, 1.0, n_cathode + 1, endpoint=True)[1:]
+    x_coords = np.concatenate([x_anode, x_mem, x_cath])
+    y_coords = np.linspace(0.0, 1.0, ny + 1, endpoint=True)
+    return x_coords, y_coords
 
-# Locate bottom boundary (y = 0)
-from dolfinx.mesh import locate_entities_boundary
 
-def bottom_boundary(x):
-    return np.isclose(x[1], 0.0)
+def local_block(n, comm):
+    """Contiguous [start, end) block of n items owned by this rank"""
+    base, remainder = divmod(n, comm.size)
+    start = comm.rank * base + min(comm.rank, remainder)
+    end = start + base + (1 if comm.rank < remainder else 0)
+    return start, end
 
-bottom_facets = locate_entities_boundary(mesh_domain, tdim-1, bottom_boundary)
 
-# Get DOFs on bottom boundary
-from dolfinx.fem import locate_dofs_topological
-bottom_dofs = locate_dofs_topological(V, tdim-1, bottom_facets)
+def layered_grid_points(x_coords, y_coords, start, end):
+    """Grid points with global (row-major) indices in [start, end)"""
+    row = len(x_coords)
+    idx = np.arange(start, end, dtype=np.int64)
+    points = np.zeros((idx.size, 3), dtype=np.float64)
+    points[:, 0] = x_coords[idx % row]
+    points[:, 1] = y_coords[idx // row]
+    return points
 
-# Separate bottom DOFs by region (anode vs cathode)
-# We need to check x-coordinate of each DOF
-dof_coords = V.tabulate_dof_coordinates()
 
-# Anode bottom: x <= 0.4, y = 0
-anode_bottom_dofs = []
-cathode_bottom_dofs = []
+def layered_grid_cells(nx, cell_type, start, end):
+    """
+    Cells with global indices in [start, end), as global node indices.
+    - quadrilateral: (n0, n1, n2, n3) in DOLFINx tensor-product order
+    - triangle: each quad split into (n0, n2, n3) and (n0, n3, n1)
+    """
+    row = nx + 1
+    idx = np.arange(start, end, dtype=np.int64)
+    if cell_type == dmesh.CellType.quadrilateral:
+        quad = idx
+    else:
+        quad, half = np.divmod(idx, 2)
+    n0 = (quad // nx) * row + quad % nx
+    n1 = n0 + 1
+    n2 = n0 + row
+    n3 = n2 + 1
+    if cell_type == dmesh.CellType.quadrilateral:
+        return np.column_stack([n0, n1, n2, n3])
+    first = half == 0
+    return np.column_stack([n0, np.where(first, n2, n3), np.where(first, n3, n1)])
+
+
+def create_layered_structured_mesh(comm, ny=40, n_anode=20, n_mem=120, n_cathode=20,
+                                   cell_type=dmesh.CellType.triangle):
+    """
+    Create a structured mesh with variable resolution:
+    - Anode (0 to 0.4): coarse (n_anode elements)
+    - Membrane (0.4 to 0.6): fine (n_mem elements)
+    - Cathode (0.6 to 1.0): coarse (n_cathode elements)
+    Points and cells are generated with array arithmetic, and each rank only
+    supplies its own contiguous block of both, so the global arrays are never
+    duplicated across ranks.
+    """
+    cell_type = dmesh.to_type(cell_type) if isinstance(cell_type, str) else cell_type
+    x_coords, y_coords = layered_coordinates(ny, n_anode, n_mem, n_cathode)
+    nx = len(x_coords) - 1
 
-for dof in bottom_dofs:
-    x_coord = dof_coords[dof, 0]
-    if x_coord <= 0.4:
-        anode_bottom_dofs.append(dof)
-    elif x_coord > 0.6:
-        cathode_bottom_dofs.append(dof)
-    # Membrane bottom (0.4 < x <= 0.6) has no BC, so skip
+    num_points = len(x_coords) * len(y_coords)
+    num_cells = nx * ny if cell_type == dmesh.CellType.quadrilateral else 2 * nx * ny
 
-anode_bottom_dofs = np.array(anode_bottom_dofs, dtype=np.int32)
-cathode_bottom_dofs = np.array(cathode_bottom_dofs, dtype=np.int32)
+    points = layered_grid_points(x_coords, y_coords, *local_block(num_points, comm))
+    cells = layered_grid_cells(nx, cell_type, *local_block(num_cells, comm))
 
-print(f"  Anode bottom DOFs: {len(anode_bottom_dofs)}")
-print(f"  Cathode bottom DOFs: {len(cathode_bottom_dofs)}")
+    # Define the P1 Lagrange element for the coordinates.
+    coord_element = basix_element("Lagrange", cell_type.name, 1, shape=(3,))
 
+    # Create DOLFINx mesh, passing the coordinate element
+    domain = dmesh.create_mesh(comm, cells, points, coord_element)
+
+    return domain
 
-# Create Dirichlet BCs
-bc_anode = fem.dirichletbc(ScalarType(0.54), anode_bottom_dofs, V)
-bc_cathode = fem.dirichletbc(ScalarType(1.0), cathode_bottom_dofs, V)
-bcs = [bc_anode, bc_cathode]
 
+def benchmark_mesh_generation(comm, target_cells=(10**4, 10**5, 10**6, 10**7),
+                              cell_type=dmesh.CellType.triangle, build_mesh=True):
+    """
+    Time layered mesh generation from 1e4 to 1e7 cells and record RSS.
+    The 20/120/20 x 40 layout is scaled uniformly to hit each target. Sizes run
+    in ascending order, so the process peak RSS (ru_maxrss) after each size is
+    attributable to that size.
+    """
 
+    cell_type = dmesh.to_type(cell_type) if isinstance(cell_type, str) else cell_type
+    cells_per_quad = 1 if cell_type == dmesh.CellType.quadrilateral else 2
+    base_quads = (20 + 120 + 20) * 40
+    results = []
+    for target in sorted(target_cells):
+        scale = np.sqrt(target / (cells_per_quad * base_quads))
+        ny, n_anode, n_mem, n_cathode = (max(1, int(round(k * scale))) for k in (40, 20, 120, 20))
+
+        t0 = time.perf_counter()
+        x_coords, y_coords = layered_coordinates(ny, n_anode, n_mem, n_cathode)
+        nx = len(x_coords) - 1
+        num_cells = nx * ny * cells_per_quad
+        layered_grid_points(x_coords, y_coords, *local_block(len(x_coords) * len(y_coords), comm))
+        layered_grid_cells(nx, cell_type, *local_block(num_cells, comm))
+        t_generate = comm.allreduce(time.perf_counter() - t0, op=MPI.MAX)
+
+        t_create = None
+        if build_mesh:
+            t0 = time.perf_counter()
+            domain = create_layered_structured_mesh(comm, ny, n_anode, n_mem, n_cathode, cell_type)
+            t_create = comm.allreduce(time.perf_counter() - t0, op=MPI.MAX)
+            del domain
+
+        peak_mb = comm.allreduce(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, op=MPI.MAX)
+        rss_mb = comm.allreduce(psutil.Process().memory_info().rss / 1024.0**2, op=MPI.MAX)
+        entry = {
+            "cells": int(num_cells), "cell_type": cell_type.name, "ranks": comm.size,
+            "ny": ny, "n_anode": n_anode, "n_mem": n_mem, "n_cathode": n_cathode,
+            "generate_s": t_generate, "create_mesh_s": t_create,
+            "peak_rss_mb": peak_mb, "rss_mb": rss_mb,
+        }
+        results.append(entry)
+        if comm.rank == 0:
+            create_str = f"{t_create:.3f}s" if t_create is not None else "-"
+            print(f"  cells={num_cells:>10d}  generate={t_generate:.3f}s  create_mesh={create_str}  "
+                  f"peak RSS={peak_mb:.1f} MB")
+    return results
 
-# ----------------------------------------------------
-# Membrane interface Dirichlet BCs (CRITICAL FIX)
-# ----------------------------------------------------
+# ------------------------------
+# Region tagging (vectorized)
+# ------------------------------
+# Region id -> (name, x_lo, x_hi); a point belongs to a region if x_lo < x <= x_hi
+# (None means unbounded). Matches anode <= 0.4 < membrane <= 0.6 < cathode.
+REGION_INTERVALS = {
+    1: ("anode", None, 0.4),
+    2: ("membrane", 0.4, 0.6),
+    3: ("cathode", 0.6, None),
+}
 
-def membrane_anode_interface(x):
-    # x = 0.4, inside membrane height
-    return np.isclose(x[0], 0.4)
 
-def membrane_cathode_interface(x):
-    # x = 0.6, inside membrane height
-    return np.isclose(x[0], 0.6)
+def region_markers(x_values, intervals=REGION_INTERVALS):
+    """Region id per x value (0 where no interval matches)"""
+    markers = np.zeros(len(x_values), dtype=np.int32)
+    for region_id, (_, x_lo, x_hi) in intervals.items():
+        mask = np.ones(len(x_values), dtype=bool)
+        if x_lo is not None:
+            mask &= x_values > x_lo
+        if x_hi is not None:
+            mask &= x_values <= x_hi
+        markers[mask] = region_id
+    return markers
 
-# Locate facets on membrane vertical interfaces
-membrane_anode_facets = locate_entities_boundary(
-    mesh_domain, tdim - 1, membrane_anode_interface
-)
 
-membrane_cathode_facets = locate_entities_boundary(
-    mesh_domain, tdim - 1, membrane_cathode_interface
-)
+def tag_cells_by_region(domain, intervals=REGION_INTERVALS):
+    """
+    Cell meshtags from cell midpoints. Owned and ghost cells are tagged from
+    their own geometry, so every rank agrees on shared cells.
+    """
+    tdim = domain.topology.dim
+    cell_map = domain.topology.index_map(tdim)
+    cells = np.arange(cell_map.size_local + cell_map.num_ghosts, dtype=np.int32)
+    midpoints = dmesh.compute_midpoints(domain, tdim, cells)
+    return meshtags(domain, tdim, cells, region_markers(midpoints[:, 0], intervals))
 
-# Locate DOFs on those facets
-membrane_anode_dofs = fem.locate_dofs_topological(
-    V, tdim - 1, membrane_anode_facets
-)
 
-membrane_cathode_dofs = fem.locate_dofs_topological(
-    V, tdim - 1, membrane_cathode_facets
-)
+def tag_boundary_facets_by_region(domain, marker, intervals=REGION_INTERVALS):
+    """Facet meshtags for boundary facets selected by marker, valued by region id"""
+    fdim = domain.topology.dim - 1
+    domain.topology.create_connectivity(fdim, domain.topology.dim)
+    facets = np.sort(locate_entities_boundary(domain, fdim, marker)).astype(np.int32)
+    midpoints = dmesh.compute_midpoints(domain, fdim, facets)
+    values = region_markers(midpoints[:, 0], intervals)
+    keep = values > 0
+    return meshtags(domain, fdim, facets[keep], values[keep])
 
-# Apply concentration Dirichlet BCs (reservoir states)
-bc_membrane_anode = fem.dirichletbc(
-    ScalarType(0.54), membrane_anode_dofs, V
-)
 
-bc_membrane_cathode = fem.dirichletbc(
-    ScalarType(1.0), membrane_cathode_dofs, V
-)
+def tag_interface_facets(domain, markers):
+    """Facet meshtags for (interior) facets, valued by the 1-based index of the matching marker"""
+    fdim = domain.topology.dim - 1
+    domain.topology.create_connectivity(fdim, domain.topology.dim)
+    facets = [dmesh.locate_entities(domain, fdim, marker) for marker in markers]
+    values = [np.full(len(f), i + 1, dtype=np.int32) for i, f in enumerate(facets)]
+    facets = np.concatenate(facets).astype(np.int32)
+    order = np.argsort(facets)
+    return meshtags(domain, fdim, facets[order], np.concatenate(values)[order])
 
-# Add to existing BC list
-bcs += [bc_membrane_anode, bc_membrane_cathode]
 
-print("  Applied membrane interface concentration BCs:")
-print("    x = 0.4 → C = 0.54 (Anode side)")
-print("    x = 0.6 → C = 1.00 (Cathode side)")
+def split_dofs_by_region(dofs, dof_coords, intervals=REGION_INTERVALS):
+    """Split a DOF array into {region_id: dofs} using (pre-tabulated) DOF coordinates"""
+    markers = region_markers(dof_coords[dofs, 0], intervals)
+    return {region_id: dofs[markers == region_id].astype(np.int32) for region_id in intervals}
 
 
 # ------------------------------
-# Setup potential field (Phi = 0 for now)
+# SUPG stabilization parameter (cell-wise)
 # ------------------------------
-V_phi = create_function_space_layered(mesh_domain, degree=1)
-Phi = fem.Function(V_phi)
-Phi.x.array[:] = 0.0
-Phi.x.scatter_forward()
+def advection_velocity(x):
+    """Advection field u = [0, (1-x)^2] at points x (shape (n, 3)), as NumPy"""
+    u = np.zeros((x.shape[0], 2))
+    u[:, 1] = (1.0 - x[:, 0])**2
+    return u
 
-# ------------------------------
-# Build species weak form region-wise
-# ------------------------------
-print(f"[{datetime.now().isoformat()}] Building species weak form...")
 
-x = ufl.SpatialCoordinate(mesh_domain)
-dt_const = fem.Constant(mesh_domain, ScalarType(dt))
-# Define advection vector once (u=[0, (1-x)^2])
-u_adv_vector = ufl.as_vector((0.0, (1.0 - x[0])**2, 0.0)) 
+def supg_xi(pe):
+    """
+    coth(Pe) - 1/Pe, evaluated without overflow or cancellation:
+    - Pe < 1e-3: series Pe/3 - Pe^3/45
+    - Pe > 20: coth(Pe) == 1 to double precision, so 1 - 1/Pe
+    - otherwise 1/tanh(Pe) - 1/Pe
+    """
+    pe = np.asarray(pe, dtype=np.float64)
+    xi = np.empty_like(pe)
+    small = pe < 1e-3
+    large = pe > 20.0
+    mid = ~(small | large)
+    xi[small] = pe[small] / 3.0 - pe[small]**3 / 45.0
+    xi[large] = 1.0 - 1.0 / pe[large]
+    xi[mid] = 1.0 / np.tanh(pe[mid]) - 1.0 / pe[mid]
+    return xi
+
+
+def cell_diameters(domain, cells):
+    """Largest vertex-to-vertex distance per cell (as ufl.CellDiameter for affine cells)"""
+    nodes = domain.geometry.x[domain.geometry.dofmap[cells]]
+    h = np.zeros(len(cells))
+    num_nodes = nodes.shape[1]
+    for i in range(num_nodes):
+        for j in range(i + 1, num_nodes):
+            h = np.maximum(h, np.linalg.norm(nodes[:, i] - nodes[:, j], axis=1))
+    return h
+
+
+def compute_cellwise_supg_tau(domain, mt, region_constants, tau=None):
+    """
+    SUPG tau per cell into a DG0 Function (owned and ghost cells, so no scatter):
+        tau = h / (2|u|) * (coth(Pe_h) - 1/Pe_h),  Pe_h = |u| h / (2 D_eff)
+    with h the cell diameter, |u| at the cell midpoint and D_eff = 1/Pe of
+    the cell's region. Cells without a region tag get tau = 0.
+    """
+    if tau is None:
+        Q = fem.functionspace(domain, basix_element("DG", domain.topology.cell_name(), 0))
+        tau = fem.Function(Q, name="supg_tau")
+    tdim = domain.topology.dim
+    cell_map = domain.topology.index_map(tdim)
+    cells = np.arange(cell_map.size_local + cell_map.num_ghosts, dtype=np.int32)
 
-def build_region_form(region_id, Ci_trial, Cn_func, w_test):
-    """Build weak form for a specific region"""
-    region_name = {1: "anode", 2: "membrane", 3: "cathode"}[region_id]
-    rc = region_constants[region_name]
-    Pe_val = float(rc["Pe"])
-    gamma_val = float(rc["gamma"])
-    Ri_val = float(rc["Ri"])
-    
-    # Time and Source terms (ALWAYS INCLUDED)
-    a_time = (Ci_trial / dt_const) * w_test * dx(region_id)
-    L_time = (Cn_func / dt_const) * w_test * dx(region_id)
-    L_source = Ri_val * w_test * dx(region_id)
-    
-    # ----------------------------------------------------
-    # Transport Terms (Diffusion, Migration, Advection)
-    # ----------------------------------------------------
-    
-    # Diffusion term
-    a_diff = (1.0 / Pe_val) * (
-        gamma_val**2 * ufl.grad(Ci_trial)[0] * ufl.grad(w_test)[0] +
-        ufl.grad(Ci_trial)[1] * ufl.grad(w_test)[1]
-    ) * dx(region_id)
-    
-    if region_id != 2: # Anode (1) and Cathode (3) - Full transport
-        
-        # Migration coefficients - Using Pe_max for migration flux term (user specified)
-        coeff_mig = z_i_c / Pe_max
-        gradPhi = ufl.grad(Phi)
-        HessianPhi = ufl.grad(ufl.grad(Phi)) 
-        d2Phi_dx2 = HessianPhi[0, 0] 
-        d2Phi_dy2 = HessianPhi[1, 1]
-        
-        # Migration terms (using user's linearization)
-        a_mig_b = - coeff_mig * (
-            gamma_val**2 * ufl.grad(Ci_trial)[0] * gradPhi[0] +
-            ufl.grad(Ci_trial)[1] * gradPhi[1]
-        ) * w_test * dx(region_id)
-        
-        a_mig_c = - coeff_mig * Ci_trial * (
-            gamma_val**2 * d2Phi_dx2 + d2Phi_dy2
-        ) * w_test * dx(region_id)
-        
-        # Advection term
-        a_adv = ufl.dot(u_adv_vector, ufl.grad(Ci_trial)) * w_test * dx(region_id)
-        
-        # Total Transport Term
-        a_transport = a_diff + a_mig_b + a_mig_c + a_adv
-        
-        # ----------------------------------------------------
-        # SUPG Stabilization Term (New: using user's coth formula)
-        # ----------------------------------------------------
-        
-        # Cell size (h)
-        h = ufl.CellDiameter(mesh_domain)
-        
-        # Magnitude of Advection Velocity |a|. Added 1e-12 for numerical stability 
-        # to prevent division by zero when U=0 (at x=1.0, cathode top).
-        U = ufl.sqrt(ufl.dot(u_adv_vector, u_adv_vector) + 1e-12)
-        
-        # Effective Diffusivity Deff (non-dimensional)
-        D_eff = (1.0 / Pe_val)
-        
-        # Cell Peclet Number: Pe_cell = |a| * h / (2 * D_eff)
-        Pe_cell = U * h / (2.0 * D_eff)
-        
-        # tau_SUPG = (h / (2*|a|)) * (coth(Pe_cell) - 1/Pe_cell)
-        # coth(x) = cosh(x) / sinh(x)
-        coth_Pe_cell = ufl.cosh(Pe_cell) / ufl.sinh(Pe_cell)
-        tau = (h / (2.0 * U)) * (coth_Pe_cell - 1.0 / Pe_cell)
-        
-        # SUPG Test Function Component: tau * (a . grad(w))
-        grad_w_dot_u = ufl.dot(u_adv_vector, ufl.grad(w_test))
-        w_stab = tau * grad_w_dot_u 
+    h = cell_diameters(domain, cells)
+    u = advection_velocity(dmesh.compute_midpoints(domain, tdim, cells))
+    U = np.sqrt(np.sum(u**2, axis=1) + 1e-12)
 
-        # The stabilization form F_stab = integral( Residual * w_stab ) dV
-        
-        # Residual LHS operator on Ci (Approximated: Time + Advection)
-        # We simplify the residual to focus on the time and advection terms 
-        # for robust stabilization, consistent with the standard SUPG theory.
-        a_res_operator = (Ci_trial / dt_const) + ufl.dot(u_adv_vector, ufl.grad(Ci_trial))
-        a_stab = a_res_operator * w_stab * dx(region_id)
-
-        # Residual RHS terms (Known terms Cn, Ri, etc.)
-        L_res_operator = (Cn_func / dt_const) + ufl.dot(u_adv_vector, ufl.grad(Cn_func)) - Ri_val
-        L_stab = L_res_operator * w_stab * dx(region_id)
-        
-        a_reg = a_time + a_transport + a_stab
-        L_reg = L_time + L_source + L_stab
-        
-    else: # Membrane (Region 2) - Diffusion ONLY (Requested Change)
-        # Migration and Advection are set to zero
-        a_transport = a_diff # Changed from 0 to a_diff
-        
-        a_reg = a_time + a_transport
-        L_reg = L_time + L_source
+    D_eff = np.full(len(cells), np.inf)
+    for region_id, (name, _, _) in REGION_INTERVALS.items():
+        D_eff[mt.indices[mt.values == region_id]] = 1.0 / float(region_constants[name]["Pe"])
+    pe_h = U * h / (2.0 * D_eff)
 
-    # a_reg = a_time + a_transport
-    # L_reg = L_time + L_source
-    
-    return a_reg, L_reg
+    values = h / (2.0 * U) * supg_xi(pe_h)
+    tau.x.array[tau.function_space.dofmap.list[cells, 0]] = values
+    return tau
 
-# Build total weak form by summing over regions
-a_total = None
-L_total = None
 
-for rid in [1,2, 3]:
-    a_reg, L_reg = build_region_form(rid, Ci, c_n, w)
-    if a_total is None:
-        a_total = a_reg
-        L_total = L_reg
-    else:
-        a_total += a_reg
-        L_total += L_reg
+def generated_code_size(ufl_form):
+    """Size in bytes of the C code FFCx generates for a UFL form (None if FFCx is unavailable)"""
+    try:
+        import ffcx.options
+        from ffcx.compiler import compile_ufl_objects
+        options = ffcx.options.get_options()
+        code_h, code_c = compile_ufl_objects([ufl_form], options=options)[:2]
+        return len(code_h) + len(code_c)
+    except Exception:
+        return None
+
+
+def benchmark_species_forms(sim, repeats=5, prefix="bench_"):
+    """
+    Compile and assemble the species forms of a Simulation and solve one step.
+    Returns (timings/kernel-size dict, copy of the solution vector).
+    """
+    comm = sim.comm
+    t0 = time.perf_counter()
+    a, L = sim.species_forms
+    t_compile = comm.allreduce(time.perf_counter() - t0, op=MPI.MAX)
+
+    solver = SpeciesSolver(a, L, sim.bcs, sim.c, sim.config["petsc_options"], prefix=prefix)
+    t_a, t_L = [], []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        solver.assemble_operator()
+        t_a.append(comm.allreduce(time.perf_counter() - t0, op=MPI.MAX))
+        t0 = time.perf_counter()
+        assemble_rhs(solver.b, a, L, sim.bcs)
+        t_L.append(comm.allreduce(time.perf_counter() - t0, op=MPI.MAX))
+    norm_A = solver.A.norm(PETSc.NormType.FROBENIUS)
+    solver.solve()
+    solution = sim.c.x.petsc_vec.copy()
+    solver.destroy()
+
+    a_ufl, L_ufl = sim.species_ufl
+    result = {
+        "compile_s": t_compile,
+        "assemble_A_s": float(np.median(t_a)),
+        "assemble_L_s": float(np.median(t_L)),
+        "kernel_bytes_A": generated_code_size(a_ufl),
+        "kernel_bytes_L": generated_code_size(L_ufl),
+        "norm_A": norm_A,
+        "finite_A": bool(np.isfinite(norm_A)),
+    }
+    return result, solution
+
+
+def relative_difference(u, u_ref):
+    """||u - u_ref|| / ||u_ref|| for PETSc vectors"""
+    diff = u.copy()
+    diff.axpy(-1.0, u_ref)
+    ref_norm = u_ref.norm()
+    value = diff.norm() / ref_norm if ref_norm > 0 else diff.norm()
+    diff.destroy()
+    return value
+
+
+def benchmark_supg_tau(config=None, comm=MPI.COMM_WORLD, repeats=5):
+    """
+    Compare the UFL coth tau ("expression") with the precomputed DG0 tau
+    ("cellwise"): form compilation time, assembly time of A and L, generated
+    kernel size, whether A is finite, and the difference of one solve.
+    """
+    results = {}
+    solutions = {}
+    for mode in ("expression", "cellwise"):
+        overrides = dict(config or {})
+        overrides.update({"supg_tau": mode, "output_format": None, "viz_enabled": False})
+        sim = Simulation(overrides, comm=comm)
+        results[mode], solutions[mode] = benchmark_species_forms(sim, repeats, prefix=f"bench_{mode}_")
+        results[mode]["tau_setup_s"] = sim.perf.time("supg_tau")
+        if comm.rank == 0:
+            r = results[mode]
+            print(f"  {mode:>10s}: compile={r['compile_s']:.3f}s  A={r['assemble_A_s']:.4f}s  "
+                  f"L={r['assemble_L_s']:.4f}s  kernel(A)={r['kernel_bytes_A']}  finite={r['finite_A']}")
+
+    results["relative_difference"] = relative_difference(solutions["cellwise"], solutions["expression"])
+    for vec in solutions.values():
+        vec.destroy()
+    return results
+
+
+def benchmark_quadrature_degree(config=None, comm=MPI.COMM_WORLD, degrees=range(2, 9),
+                                reference_degree=12, repeats=5):
+    """
+    Sweep one quadrature degree applied to every species-form term against a
+    high-degree reference: assembly time, kernel size and the relative
+    difference of one solve. Also reports the UFL-estimated degree ("auto").
+    """
+    def run(degree):
+        overrides = dict(config or {})
+        overrides.update({"output_format": None, "viz_enabled": False,
+                          "quadrature_degree": {term: degree for term in DEFAULT_CONFIG["quadrature_degree"]}})
+        sim = Simulation(overrides, comm=comm)
+        return benchmark_species_forms(sim, repeats, prefix=f"bench_q{degree or 'auto'}_")
+
+    _, u_ref = run(reference_degree)
+    results = {"reference_degree": reference_degree, "sweep": []}
+    for degree in [None, *degrees]:
+        entry, u = run(degree)
+        entry["degree"] = degree if degree is not None else "auto"
+        entry["relative_difference"] = relative_difference(u, u_ref)
+        u.destroy()
+        results["sweep"].append(entry)
+        if comm.rank == 0:
+            print(f"  degree={str(entry['degree']):>4s}  A={entry['assemble_A_s']:.4f}s  "
+                  f"L={entry['assemble_L_s']:.4f}s  kernel(A)={entry['kernel_bytes_A']}  "
+                  f"rel. diff={entry['relative_difference']:.3e}")
+    u_ref.destroy()
+    return results
+
+
+# ------------------------------
+# Strong/weak scaling harness
+# ------------------------------
+def scaling_rank_counts(max_ranks):
+    """1, 2, 4, ... up to max_ranks (max_ranks itself always included)"""
+    counts = [1]
+    while counts[-1] * 2 <= max_ranks:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_ranks:
+        counts.append(max_ranks)
+    return counts
+
+
+def run_scaling_study(script, max_ranks, kind="strong", base_scale=1, launcher="mpirun",
+                      extra_args=()):
+    """
+    Run this script under `launcher -n P` for P = 1..max_ranks and collect the
+    per-phase timings each run writes with --timings-json.
+    - strong: fixed mesh (mesh_scale = base_scale)
+    - weak: mesh grows with P (mesh_scale = base_scale * P), constant cells per rank
+    Efficiency is T1/(P*TP) for strong and T1/TP for weak scaling.
+    """
+    import subprocess
+    import tempfile
+
+    results = []
+    for ranks in scaling_rank_counts(max_ranks):
+        scale = base_scale * ranks if kind == "weak" else base_scale
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            report_path = tmp.name
+        cmd = [launcher, "-n", str(ranks), sys.executable, script, "run",
+               "--mesh-scale", str(scale), "--timings-json", report_path, *extra_args]
+        print(f"[scaling] {' '.join(cmd)}", flush=True)
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        with open(report_path) as f:
+            report = json.load(f)
+        os.remove(report_path)
+        results.append(report)
+
+    t_ref = results[0]["phases"]["total"]
+    for report in results:
+        t_total = report["phases"]["total"]
+        ideal = 1.0 if kind == "weak" else float(report["ranks"])
+        report["speedup"] = t_ref / t_total
+        report["efficiency"] = t_ref / (ideal * t_total)
+        phases = report["phases"]
+        print(f"[scaling] {kind} P={report['ranks']:>3d} cells={report['cells']:>9d}  "
+              f"assembly={phases['assembly']:.3f}s solve={phases['solve']:.3f}s io={phases['io']:.3f}s "
+              f"total={t_total:.3f}s  efficiency={report['efficiency']:.2f}", flush=True)
+    return results
+
 
-# 2. Add the boundary integral (Outflow BC) ONCE after the loop
-# The outflow term is: a_outflow = integral( (u_adv . n) * Ci * w dS )
-n = ufl.FacetNormal(mesh_domain)
-# u_adv_vector = ufl.as_vector((0.0, (1.0 - x[0])**2, 0.0))
-# u_dot_n_outflow = ufl.dot(u_adv_vector, n) 
+# ------------------------------
+# Startup: JIT cache warmup and benchmark
+# ------------------------------
+WARMUP_VARIANTS = {"supg_tau": ["expression", "cellwise"], "adaptive_dt": [False, True],
+                   "species_solver": ["linear", "newton"]}
 
-# # Apply outflow ONLY to Anode Top (Tag 1) and Cathode Top (Tag 3) (Fixed)
-# # a_outflow = u_dot_n_outflow * Ci * w * (ds(1) + ds(3)) 
 
-# # # Add outflow term to the total LHS form
-# # a_total += a_outflow
+def warmup_forms(config=None, comm=MPI.COMM_WORLD, all_variants=False):
+    """
+    Precompile the forms of a configuration into the JIT cache. With
+    all_variants, also every combination of WARMUP_VARIANTS (form-changing
+    options), so later jobs of a sweep start with a warm cache.
+    """
+    import itertools
+
+    variants = [{}]
+    if all_variants:
+        keys = list(WARMUP_VARIANTS)
+        variants = [dict(zip(keys, values)) for values in itertools.product(*WARMUP_VARIANTS.values())]
+    results = []
+    for variant in variants:
+        overrides = dict(config or {})
+        overrides.update(variant)
+        sim = Simulation(overrides, comm=comm)
+        t_compile = comm.allreduce(sim.warmup(), op=MPI.MAX)
+        results.append({"variant": variant, "compile_s": t_compile})
+        if comm.rank == 0:
+            print(f"  warmup {variant or 'configuration'}: form compilation {t_compile:.2f}s", flush=True)
+    return results
+
+
+def benchmark_startup(script, extra_args=(), repeats=2):
+    """
+    Wall time (interpreter start to exit) of `warmup` and of a one-step run,
+    first with an empty (cold) JIT cache directory, then with the cache it
+    left behind (warm, median of repeats).
+    """
+    import subprocess
+    import tempfile
+
+    def timed(cmd):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - t0
+
+    results = {}
+    for label, command in (("warmup", ["warmup"]),
+                           ("run_1_step", ["run", "--num-steps", "1", "--no-output"])):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cmd = [sys.executable, script, *command, "--jit-cache-dir", cache_dir, *extra_args]
+            results[f"{label}_cold_s"] = timed(cmd)
+            results[f"{label}_warm_s"] = float(np.median([timed(cmd) for _ in range(repeats)]))
+        print(f"[startup] {label:>10s}: cold cache {results[f'{label}_cold_s']:.2f}s, "
+              f"warm cache {results[f'{label}_warm_s']:.2f}s", flush=True)
+    return results
 
-h_boundary = ufl.FacetArea(mesh_domain)  # Characteristic boundary size
-alpha_outflow = fem.Constant(mesh_domain, ScalarType(0.01))  # Small penalty
 
-# Penalty for deviation from pure advection
-a_outflow_penalty = alpha_outflow * h_boundary * (
-    ufl.dot(ufl.grad(Ci), n) * ufl.dot(ufl.grad(w), n)
-) * (ds(1) + ds(3))
+# ------------------------------
+# Preconditioner selection
+# ------------------------------
+# Species KSP/PC candidates available in a stock PETSc build (ILU is serial-only)
+PC_CANDIDATES = {
+    "ilu0": {"ksp_type": "gmres", "pc_type": "ilu", "pc_factor_levels": 0},
+    "ilu1": {"ksp_type": "gmres", "pc_type": "ilu", "pc_factor_levels": 1},
+    "ilu2": {"ksp_type": "gmres", "pc_type": "ilu", "pc_factor_levels": 2},
+    "gamg": {"ksp_type": "gmres", "pc_type": "gamg"},
+    "asm_ilu": {"ksp_type": "gmres", "pc_type": "asm", "pc_asm_overlap": 1, "sub_pc_type": "ilu"},
+    "bjacobi_ilu": {"ksp_type": "gmres", "pc_type": "bjacobi", "sub_pc_type": "ilu"},
+}
+SERIAL_ONLY_PCS = ("ilu0", "ilu1", "ilu2")
+
 
-a_total += a_outflow_penalty
+def benchmark_preconditioners(config=None, comm=MPI.COMM_WORLD, mesh_scales=(1, 2, 4),
+                              candidates=None):
+    """
+    Solve the first species step with every candidate KSP/PC per mesh scale:
+    PC setup time, solve time, iterations and convergence. Tolerances come
+    from the configured petsc_options.
+    """
+    candidates = list(candidates or PC_CANDIDATES)
+    if comm.size > 1:
+        candidates = [name for name in candidates if name not in SERIAL_ONLY_PCS]
+    results = []
+    for scale in mesh_scales:
+        overrides = dict(config or {})
+        overrides.update({"mesh_scale": scale, "output_format": None, "viz_enabled": False})
+        sim = Simulation(overrides, comm=comm)
+        a, L = sim.species_forms
+        tolerances = {key: value for key, value in sim.config["petsc_options"].items()
+                      if key in ("ksp_rtol", "ksp_atol", "ksp_max_it")}
+        dofs = sim.V.dofmap.index_map.size_global
+        for name in candidates:
+            options = dict(PC_CANDIDATES[name], **tolerances)
+            entry = {"mesh_scale": scale, "dofs": dofs, "ranks": comm.size, "candidate": name,
+                     "petsc_options": options}
+            solver = SpeciesSolver(a, L, sim.bcs, sim.c, options, prefix=f"pc_{name}_")
+            x = solver.b.duplicate()
+            try:
+                solver.assemble_operator()
+                assemble_rhs(solver.b, a, L, sim.bcs)
+                x.set(0.0)
+                t0 = time.perf_counter()
+                solver.ksp.setUp()
+                entry["setup_s"] = comm.allreduce(time.perf_counter() - t0, op=MPI.MAX)
+                t0 = time.perf_counter()
+                solver.ksp.solve(solver.b, x)
+                entry["solve_s"] = comm.allreduce(time.perf_counter() - t0, op=MPI.MAX)
+                entry["iterations"] = solver.ksp.getIterationNumber()
+                entry["reason"] = solver.ksp.getConvergedReason()
+                entry["converged"] = entry["reason"] > 0
+            except PETSc.Error as e:
+                entry.update(converged=False, error=str(e))
+            finally:
+                x.destroy()
+                solver.destroy()
+            results.append(entry)
+            if comm.rank == 0:
+                if "error" in entry:
+                    print(f"  scale={scale} dofs={dofs:>9d} {name:>12s}: failed ({entry['error']})")
+                else:
+                    print(f"  scale={scale} dofs={dofs:>9d} {name:>12s}: setup={entry['setup_s']:.3f}s "
+                          f"solve={entry['solve_s']:.3f}s its={entry['iterations']:>4d} "
+                          f"{'ok' if entry['converged'] else 'NOT CONVERGED'}", flush=True)
+    return results
+
+
+def select_preconditioner(results):
+    """
+    Fastest converged candidate (setup + solve) per mesh scale, and overall the
+    fastest at the largest scale: {"petsc_options", "candidate", "ranks",
+    "by_mesh_scale"}. Each selection also carries "parallel", the fastest
+    candidate that is not serial-only, used when a serial choice is loaded by
+    a run on more than one rank.
+    """
+    def fastest(entries):
+        return min(entries, key=lambda entry: entry["setup_s"] + entry["solve_s"], default=None)
+
+    def selection(entries):
+        best, best_parallel = fastest(entries), fastest(
+            [entry for entry in entries if entry["candidate"] not in SERIAL_ONLY_PCS])
+        chosen = {"candidate": best["candidate"], "petsc_options": best["petsc_options"]}
+        if best_parallel is not None:
+            chosen["parallel"] = {"candidate": best_parallel["candidate"],
+                                  "petsc_options": best_parallel["petsc_options"]}
+        return chosen
+
+    converged = [entry for entry in results if entry["converged"]]
+    if not converged:
+        raise RuntimeError("No preconditioner candidate converged")
+    scales = sorted({entry["mesh_scale"] for entry in converged})
+    by_scale = {scale: selection([entry for entry in converged if entry["mesh_scale"] == scale])
+                for scale in scales}
+    return {
+        **by_scale[scales[-1]],
+        "ranks": converged[0]["ranks"],
+        "by_mesh_scale": {str(scale): chosen for scale, chosen in by_scale.items()},
+        "created": datetime.now().isoformat(),
+    }
+
+
+def save_solver_choice(path, choice):
+    """Add (or replace) the selection for its rank count in a solver-choice file"""
+    saved = {"by_ranks": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if "by_ranks" not in saved:
+            # Single-selection file written before selections were kept per rank count
+            saved = {"by_ranks": {str(saved.get("ranks", 1)): saved}}
+    saved["by_ranks"][str(choice["ranks"])] = choice
+    with open(path, "w") as f:
+        json.dump(saved, f, indent=2)
+    return saved
+
+
+def load_solver_choice(path, mesh_scale, ranks=1):
+    """
+    (candidate, petsc_options) saved by autotune-pc: the selection benchmarked at
+    this rank count (else the closest one), for mesh_scale if it was benchmarked.
+    On more than one rank a serial-only choice is replaced by the fastest
+    parallel candidate of the same benchmark, or made parallel as block Jacobi.
+    """
+    with open(path) as f:
+        saved = json.load(f)
+    by_ranks = saved.get("by_ranks") or {str(saved.get("ranks", 1)): saved}
+    closest = min(by_ranks, key=lambda key: (abs(int(key) - ranks), -int(key)))
+    choice = by_ranks[closest]
+    chosen = choice["by_mesh_scale"].get(str(mesh_scale), choice)
+    if ranks > 1 and chosen["candidate"] in SERIAL_ONLY_PCS:
+        if "parallel" in chosen:
+            chosen = chosen["parallel"]
+        else:
+            return f"bjacobi({chosen['candidate']})", parallel_pc_options(chosen["petsc_options"], ranks)
+    return chosen["candidate"], chosen["petsc_options"]
 
 
-print(f"  Added Convective Outflow BC term to the top boundaries: Anode (ds(1)) and Cathode (ds(3)).")
+# ------------------------------
+# Parameter sweeps (forms compiled once per worker)
+# ------------------------------
+def set_dotted(params, path, value):
+    """params[a][b][c] = value for path "a.b.c" (intermediate dicts are created)"""
+    *parents, key = path.split(".")
+    for name in parents:
+        params = params.setdefault(name, {})
+    params[key] = value
+
+
+def flatten_dotted(params, prefix=""):
+    """Inverse of set_dotted: nested dict -> {"a.b.c": value}"""
+    flat = {}
+    for key, value in params.items():
+        if isinstance(value, dict):
+            flat.update(flatten_dotted(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def expand_parameter_grid(grid):
+    """{dotted key: [values]} -> one parameter set per point of the Cartesian product"""
+    import itertools
+
+    cases = []
+    for values in itertools.product(*grid.values()):
+        params = {}
+        for path, value in zip(grid, values):
+            set_dotted(params, path, value)
+        cases.append(params)
+    return cases
+
+
+_sweep_worker = {}
+
+
+def _init_sweep_worker(config):
+    """Build the mesh, forms and solvers once per worker process"""
+    sys.stdout = open(os.devnull, "w")
+    t0 = time.perf_counter()
+    sim = Simulation(config, comm=MPI.COMM_SELF)
+    sim.setup()
+    _sweep_worker.update(sim=sim, setup_s=time.perf_counter() - t0)
+
+
+def _run_sweep_case(index, params):
+    sim = _sweep_worker["sim"]
+    num_ksp = len(sim.perf.ksp_log)
+    t0 = time.perf_counter()
+    # Parameters are applied to the worker's base configuration, not to the previous case's
+    sim.reset(params)
+    diagnostics = {}
+    while not sim.finished():
+        diagnostics = sim.step()
+    species_its = [entry["iterations"] for entry in sim.perf.ksp_log[num_ksp:]
+                   if entry["solver"].startswith("species")]
+    return {
+        "case": index, **flatten_dotted(params),
+        "worker": os.getpid(), "worker_setup_s": _sweep_worker["setup_s"],
+        "time_s": time.perf_counter() - t0, "steps": sim.n, "t": sim.t,
+        "c_min": diagnostics.get("c_min"), "c_max": diagnostics.get("c_max"),
+        "darcy_u_max": diagnostics.get("darcy_u_max"), "species_ksp_its": sum(species_its),
+    }
+
+
+def run_parameter_sweep(config, cases, workers=None):
+    """
+    Run every parameter set in cases (dicts of Simulation.SWEEP_PARAMETERS)
+    over a local process pool. Each worker builds the mesh and compiles the
+    forms once; a case only resets the state and updates fem.Constants.
+    Returns one row per case (parameters, diagnostics, timings).
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    base = dict(config or {})
+    base.update({"output_format": None, "viz_enabled": False, "checkpoint_every": 0, "restart": False,
+                 "report_json": None, "timings_json": None})
+    # A term pruned for Ri == 0 must stay in the forms if any case sets Ri
+    if any("Ri" in values for case in cases for values in case.get("region_constants", {}).values()):
+        base.setdefault("physics_terms", {})["source"] = True
+
+    # Workers are spawned (not forked) so each one initializes its own MPI/PETSc
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_sweep_worker, initargs=(base,)) as pool:
+        rows = []
+        for row in pool.map(_run_sweep_case, range(len(cases)), cases):
+            rows.append(row)
+            print(f"[sweep] case {row['case'] + 1}/{len(cases)}: {row['time_s']:.2f}s "
+                  f"(worker setup {row['worker_setup_s']:.2f}s), c in [{row['c_min']:.4f}, {row['c_max']:.4f}]",
+                  flush=True)
+    return rows
+
+
+def write_table(rows, path):
+    """Rows (dicts) as CSV, or as JSON for a .json path"""
+    import csv
+
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(rows, f, indent=2)
+        return
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
 
-# Convert to UFL forms
-a = fem.form(a_total)
-L = fem.form(L_total)
 
 # ------------------------------
-# Setup Darcy problem in membrane (for visualization only)
+# Boundary / interface markers
 # ------------------------------
-print(f"[{datetime.now().isoformat()}] Setting up Darcy problem in membrane...")
+def top_boundary(x):
+    """Locate top boundary (y=1)"""
+    return np.isclose(x[1], 1.0)
 
-# Create mixed function space for Darcy (u: velocity, p: pressure)
-P2_vec = basix_element("Lagrange", mesh_domain.topology.cell_name(), 2, shape=(mesh_domain.geometry.dim,))
-P1 = basix_element("Lagrange", mesh_domain.topology.cell_name(), 1)
-ME = mixed_element([P2_vec, P1])
-W = fem.functionspace(mesh_domain, ME)
 
-print(f"  Mixed space DOFs: {W.dofmap.index_map.size_global}")
+def bottom_boundary(x):
+    """Locate bottom boundary (y=0)"""
+    return np.isclose(x[1], 0.0)
 
-# Initialize the solution function for the Darcy problem (u, p)
-sol_darcy = fem.Function(W)
 
-# --- Setup Gauge Pressure BC (Essential for Darcy well-posedness) ---
-# 1. Get the pressure subspace V_p (index 1 in the mixed space W) and its collapsed form
-V_p_subspace = W.sub(1)
+def membrane_anode_interface(x):
+    # x = 0.4, inside membrane height
+    return np.isclose(x[0], 0.4)
+
+
+def membrane_cathode_interface(x):
+    # x = 0.6, inside membrane height
+    return np.isclose(x[0], 0.6)
 
-# Handle potential tuple return (Space, Map) from collapse()
-V_p_collapsed_raw = V_p_subspace.collapse()
-if isinstance(V_p_collapsed_raw, tuple):
-    V_p_collapsed = V_p_collapsed_raw[0]
-else:
-    V_p_collapsed = V_p_collapsed_raw
 
-# 2. Define a function to locate DOFs on the bottom boundary (y=0) within the membrane (0.4 < x < 0.6)
 def membrane_p_point(x):
-    # Check within the membrane region and on the bottom boundary (y=0)
-    return (x[0] > 0.4) & (x[0] < 0.6) & np.isclose(x[1], 0.0)
-
-# 3. Manually locate the DOFs using coordinates in the collapsed space
-dof_coords_collapsed = V_p_collapsed.tabulate_dof_coordinates() 
-dof_mask = membrane_p_point(dof_coords_collapsed.T)
-dofs_collapsed = np.where(dof_mask)[0].astype(np.int32)
-
-# 4. Map the located DOFs back to the SubSpace W.sub(1)
-# FIXED: Use array indexing, which replaces the removed 'remap_dof_layout_from_collapsed' method.
-# This maps the local indices in the collapsed space back to the global indices of the subspace in W.
-dofs_p = np.array(V_p_subspace.dofmap.list[dofs_collapsed], dtype=np.int32)
-
-# 5. Create the BC (p=0) using the first found DOF to fix the gauge pressure
-if dofs_p.size > 0:
-    # Only need one DOF to fix the pressure constant
-    bc_p = fem.dirichletbc(ScalarType(0.0), dofs_p[0], V_p_subspace)
-    bcs_darcy = [bc_p]
-    print(f"  Applied Darcy BC: Fixed pressure at a single point on membrane bottom.")
-else:
-    bcs_darcy = []
-    print("  Warning: Could not locate pressure DOF for gauge fixing.")
-
-# Trial and test functions
-(u_trial, p_trial) = ufl.TrialFunctions(W)
-(v_test, q_test) = ufl.TestFunctions(W)
-
-# Darcy weak form (integrated only over membrane region 2)
-a_darcy = (
-    (1.0 / Re_val) * ufl.inner(ufl.grad(u_trial), ufl.grad(v_test)) * dx(2) +
-    (1.0 / (Re_val * Da_val)) * ufl.inner(u_trial, v_test) * dx(2) -
-    ufl.div(v_test) * p_trial * dx(2) -
-    ufl.div(u_trial) * q_test * dx(2)
-)
-
-# FIXED: Corrected constant to 3 components (0.0, 0.0, 0.0)
-L_darcy = ufl.inner(fem.Constant(mesh_domain, ScalarType((0.0, 0.0, 0.0))), v_test) * dx(2)
-
-a_darcy_form = fem.form(a_darcy)
-L_darcy_form = fem.form(L_darcy)
-
-# ------------------------------
-# Time-stepping loop
-# ------------------------------
-print(f"[{datetime.now().isoformat()}] Starting time-stepping loop...")
-print(f"  Total time: {T}s, Steps: {num_steps}, dt: {dt}s")
-
-c = fem.Function(V)
-c.x.array[:] = c_n.x.array
-c.x.scatter_forward()
-
-# Visualize initial condition
-try:
-    visualize_layered_solution("conc_t00", mesh_domain, c_n, title=f"Na+ concentration t=0.000s")
-    print(f"  Exported initial visualization: assets/conc_t00.html")
-except Exception as e:
-    print(f"  Warning: Initial visualization failed - {e}")
-
-start_time = time.time()
-
-for n in range(1, num_steps + 1):
-    t_curr = n * dt
-    print(f"\n[{datetime.now().isoformat()}] Time step {n}/{num_steps}: t = {t_curr:.4f}s")
-    
-    # Solve species transport equation
-    # FIXED: Explicitly pass solution function 'c'
-    problem_species = LinearProblem(a, L, bcs=bcs, petsc_options=petsc_options, u=c)
-    problem_species.solve()
-    c.x.scatter_forward()
-    
-    # Compute min/max concentration
-    c_min = np.min(c.x.array)
-    c_max = np.max(c.x.array)
-    print(f"  Concentration: min={c_min:.6f}, max={c_max:.6f}")
-    
-    # Solve Darcy in membrane (for visualization/logging only)
-    try:
-        # Pass sol_darcy, bcs_darcy, AND darcy_petsc_options
-        problem_darcy = LinearProblem(a_darcy_form, L_darcy_form, bcs=bcs_darcy, petsc_options=darcy_petsc_options, u=sol_darcy) 
+    """Membrane bottom-left corner (0.4, 0), used to fix the Darcy pressure gauge"""
+    return np.isclose(x[0], 0.4) & np.isclose(x[1], 0.0)
+
+
+# ------------------------------
+# Simulation driver
+# ------------------------------
+class Simulation:
+    """
+    Layered species + Darcy simulation driven by a configuration dict
+    (see DEFAULT_CONFIG; missing keys take the defaults).
+    - mesh, spaces, forms and the Darcy problem are built lazily on first use
+    - setup() creates the solvers and output and writes the initial state
+    - step() advances one time step, run() runs all num_steps and finalizes
+    Forms are compiled through the DOLFINx JIT cache, so several Simulation
+    objects with the same form structure in one process reuse the kernels.
+    """
+
+    def __init__(self, config=None, comm=MPI.COMM_WORLD):
+        self.config = make_config(config)
+        self.comm = comm
+        cfg = self.config
+        if cfg["petsc_options_file"] is not None:
+            candidate, cfg["petsc_options"] = load_solver_choice(cfg["petsc_options_file"], cfg["mesh_scale"],
+                                                                 ranks=comm.size)
+            self.log(f"  Species KSP/PC from {cfg['petsc_options_file']}: {candidate} ({comm.size} rank(s))")
+        cfg["petsc_options"] = parallel_pc_options(cfg["petsc_options"], comm.size)
+        # set_parameters() applies changes to this, never on top of earlier changes
+        self._base_config = copy.deepcopy(cfg)
+        self.T = float(cfg["T"])
+        self.num_steps = int(cfg["num_steps"])
+        self.dt = self.T / float(self.num_steps)
+
+        self.n = 0
+        self.t = 0.0
+        self.is_setup = False
+        self.u_mag_max = 0.0
+        self.perf = PerformanceReport(comm, petsc_stages=cfg["petsc_log_stages"])
+        self.species_solver = None
+        self.species_solvers = []
+        self._tau_cache = {}
+        self._region_constants = {}
+        self.species_split = {}
+        self.steady = False
+        self.dropped_terms = []
+        self.uses_phi = False
+        self.darcy_stage = None
+        self.visualizer = None
+        self.writer = None
+        self.diagnostics = None
+        self.checkpointer = None
+
+    def log(self, message, all_ranks=False):
+        """Print progress once (rank 0), or from every rank with a rank prefix"""
+        if all_ranks and self.comm.size > 1:
+            print(f"[rank {self.comm.rank}] {message}", flush=True)
+        elif all_ranks or self.comm.rank == 0:
+            print(message, flush=True)
+
+    # ------------------------------
+    # Mesh and region tags
+    # ------------------------------
+    @cached_property
+    def mesh(self):
+        cfg = self.config
+        self.log(f"[{datetime.now().isoformat()}] Creating layered mesh...")
+        with self.perf.phase("mesh"):
+            mesh_domain = create_layered_structured_mesh(
+                self.comm, ny=cfg["ny"] * cfg["mesh_scale"], n_anode=cfg["n_anode"], n_mem=cfg["n_mem"],
+                n_cathode=cfg["n_cathode"], cell_type=cfg["cell_type"])
+        self.tdim = mesh_domain.topology.dim
+        self.log(f"  Mesh has {mesh_domain.topology.index_map(self.tdim).size_global} cells "
+                 f"on {self.comm.size} rank(s)")
+        return mesh_domain
+
+    @cached_property
+    def tags(self):
+        """(cell tags mt, top facet tags ft), tagged by region"""
+        mesh_domain = self.mesh
+        with self.perf.phase("tagging"):
+            # Markers: 1->anode, 2->membrane, 3->cathode (from cell midpoints)
+            mt = tag_cells_by_region(mesh_domain)
+
+            # Tag facets (boundaries) for BCs: Anode Top (1), Membrane Top (2), Cathode Top (3)
+            # Anode/Cathode tops carry the outflow term, the membrane top has none
+            ft = tag_boundary_facets_by_region(mesh_domain, top_boundary)
+
+        # Count owned cells only (ghosts are owned, and counted, by another rank)
+        owned_tags = mt.values[mt.indices < mesh_domain.topology.index_map(self.tdim).size_local]
+        self.log(f"  Anode cells: {global_count(self.comm, owned_tags == 1)}")
+        self.log(f"  Membrane cells: {global_count(self.comm, owned_tags == 2)}")
+        self.log(f"  Cathode cells: {global_count(self.comm, owned_tags == 3)}")
+        return mt, ft
+
+    @cached_property
+    def measures(self):
+        """Region measures (dx, ds)"""
+        mt, ft = self.tags
+        dx = ufl.Measure("dx", domain=self.mesh, subdomain_data=mt)
+        ds = ufl.Measure("ds", domain=self.mesh, subdomain_data=ft)
+        return dx, ds
+
+    # ------------------------------
+    # Function spaces, initial conditions and BCs
+    # ------------------------------
+    @cached_property
+    def V(self):
+        self.log(f"[{datetime.now().isoformat()}] Creating function spaces...")
+        return create_function_space_layered(self.mesh, degree=self.config["degree"])
+
+    @property
+    def species_names(self):
+        """Species in configuration order; the first one is c/c_n"""
+        return list(self.config["species"])
+
+    def species_region_constants(self, name):
+        """Region constants of a species (shared constants + its own overrides)"""
+        constants = copy.deepcopy(self.config["region_constants"])
+        for region_name, values in self.config["species"][name].get("region_constants", {}).items():
+            constants[region_name].update(values)
+        return constants
+
+    def species_initial_condition(self, name):
+        spec = self.config["species"][name]
+        c_n = set_layered_initial_conditions(self.V, name, values=spec.get("initial"))
+        c_n.x.scatter_forward()
+        return c_n
+
+    @cached_property
+    def c_n(self):
+        # Initial concentration
+        return self.species_initial_condition(self.species_names[0])
+
+    @cached_property
+    def c(self):
+        c = fem.Function(self.V, name="concentration")
+        c.x.array[:] = self.c_n.x.array
+        c.x.scatter_forward()
+        return c
+
+    @cached_property
+    def species(self):
+        """{name: {"c", "c_n", "bcs"}} for every species (the first reuses c, c_n, bcs)"""
+        names = self.species_names
+        species = {names[0]: {"c": self.c, "c_n": self.c_n, "bcs": self.bcs}}
+        for name in names[1:]:
+            c_n = self.species_initial_condition(name)
+            c = fem.Function(self.V, name=f"concentration_{name}")
+            c.x.array[:] = c_n.x.array
+            c.x.scatter_forward()
+            bcs = self.make_species_bcs(self.config["species"][name]["boundary"])
+            species[name] = {"c": c, "c_n": c_n, "bcs": bcs}
+        return species
+
+    @cached_property
+    def species_groups(self):
+        """
+        Species sharing one operator: identical region constants ("batched"),
+        or one group per species ("separate")
+        """
+        if self.config["species_solve"] == "separate":
+            return [[name] for name in self.species_names]
+        groups = {}
+        for name in self.species_names:
+            key = json.dumps(self.species_region_constants(name), sort_keys=True)
+            groups.setdefault(key, []).append(name)
+        return list(groups.values())
+
+    @cached_property
+    def bcs(self):
+        """Dirichlet BCs of the first species"""
+        return self.make_species_bcs(self.config["species"][self.species_names[0]]["boundary"])
+
+    def make_species_bcs(self, boundary):
+        """Dirichlet BCs with boundary = {"anode": value, "cathode": value} on the located DOFs"""
+        V = self.V
+        dofs = self.bc_dofs
+        return [
+            fem.dirichletbc(ScalarType(boundary["anode"]), dofs["anode_bottom"], V),
+            fem.dirichletbc(ScalarType(boundary["cathode"]), dofs["cathode_bottom"], V),
+            fem.dirichletbc(ScalarType(boundary["anode"]), dofs["membrane_anode"], V),
+            fem.dirichletbc(ScalarType(boundary["cathode"]), dofs["membrane_cathode"], V),
+        ]
+
+    @cached_property
+    def bc_dofs(self):
+        """Dirichlet DOFs: anode/cathode bottom and the membrane interfaces"""
+        self.log(f"[{datetime.now().isoformat()}] Setting up boundary conditions...")
+        mesh_domain, V, tdim = self.mesh, self.V, self.tdim
+
+        with self.perf.phase("tagging"):
+            # Get DOFs on bottom boundary (y = 0)
+            bottom_facets = locate_entities_boundary(mesh_domain, tdim - 1, bottom_boundary)
+            bottom_dofs = fem.locate_dofs_topological(V, tdim - 1, bottom_facets)
+
+            # Separate bottom DOFs by region (anode vs cathode) from DOF x-coordinates;
+            # the coordinates are tabulated once and reused
+            dof_coords = V.tabulate_dof_coordinates()
+            bottom_dofs_by_region = split_dofs_by_region(bottom_dofs, dof_coords)
+
+        # Membrane bottom (0.4 < x <= 0.6) has no BC
+        anode_bottom_dofs = bottom_dofs_by_region[1]
+        cathode_bottom_dofs = bottom_dofs_by_region[3]
+
+        num_owned_dofs = V.dofmap.index_map.size_local
+        self.log(f"  Anode bottom DOFs: {global_count(self.comm, anode_bottom_dofs < num_owned_dofs)}")
+        self.log(f"  Cathode bottom DOFs: {global_count(self.comm, cathode_bottom_dofs < num_owned_dofs)}")
+
+        # ----------------------------------------------------
+        # Membrane interface Dirichlet BCs (CRITICAL FIX)
+        # ----------------------------------------------------
+        # Locate facets on membrane vertical interfaces
+        membrane_anode_facets = locate_entities_boundary(mesh_domain, tdim - 1, membrane_anode_interface)
+        membrane_cathode_facets = locate_entities_boundary(mesh_domain, tdim - 1, membrane_cathode_interface)
+
+        # Locate DOFs on those facets
+        membrane_anode_dofs = fem.locate_dofs_topological(V, tdim - 1, membrane_anode_facets)
+        membrane_cathode_dofs = fem.locate_dofs_topological(V, tdim - 1, membrane_cathode_facets)
+
+        # Concentration Dirichlet BCs (reservoir states) take the anode/cathode values
+        for name in self.species_names:
+            boundary = self.config["species"][name]["boundary"]
+            self.log(f"  Applied membrane interface concentration BCs ({name}):")
+            self.log(f"    x = 0.4 → C = {boundary['anode']:.2f} (Anode side)")
+            self.log(f"    x = 0.6 → C = {boundary['cathode']:.2f} (Cathode side)")
+        return {"anode_bottom": anode_bottom_dofs, "cathode_bottom": cathode_bottom_dofs,
+                "membrane_anode": membrane_anode_dofs, "membrane_cathode": membrane_cathode_dofs}
+
+    @cached_property
+    def Phi(self):
+        # Setup potential field (Phi = 0 for now)
+        V_phi = create_function_space_layered(self.mesh, degree=1)
+        Phi = fem.Function(V_phi)
+        Phi.x.array[:] = 0.0
+        Phi.x.scatter_forward()
+        return Phi
+
+    @cached_property
+    def dt_const(self):
+        return fem.Constant(self.mesh, ScalarType(self.dt))
+
+    def tau_field(self, species):
+        """DG0 SUPG tau, precomputed per cell (supg_tau = cellwise), one per species group"""
+        if species not in self._tau_cache:
+            mt, _ = self.tags
+            with self.perf.phase("supg_tau"):
+                self._tau_cache[species] = compute_cellwise_supg_tau(
+                    self.mesh, mt, self.species_region_constants(species))
+        return self._tau_cache[species]
+
+    def region_constant_fields(self, species):
+        """Pe, gamma, Ri per region as fem.Constants, one set per species group"""
+        if species not in self._region_constants:
+            self._region_constants[species] = {
+                region_name: {key: fem.Constant(self.mesh, ScalarType(value)) for key, value in values.items()}
+                for region_name, values in self.species_region_constants(species).items()}
+        return self._region_constants[species]
+
+    @cached_property
+    def phi_coupling(self):
+        """Coupling of the potential to concentration (species_solver = "newton")"""
+        return fem.Constant(self.mesh, ScalarType(self.config["phi_coupling"]))
+
+    @cached_property
+    def global_constants(self):
+        """z_i_c and Pe_max as fem.Constants (migration coefficient)"""
+        return {key: fem.Constant(self.mesh, ScalarType(self.config[key])) for key in ("z_i_c", "Pe_max")}
+
+    # ------------------------------
+    # Species weak form (region-wise)
+    # ------------------------------
+    @property
+    def jit_options(self):
+        options = dict(self.config["jit_options"])
+        if self.config["jit_cache_dir"] is not None:
+            options["cache_dir"] = self.config["jit_cache_dir"]
+        return options
+
+    def compile_form(self, form):
+        """fem.form with the configured JIT options (kernels come from the cache when present)"""
+        return fem.form(form, jit_options=self.jit_options)
+
+    def term_measure(self, measure, subdomain_id, term):
+        """measure(subdomain_id) with the configured quadrature degree of a form term"""
+        return measure(subdomain_id, degree=self.config["quadrature_degree"].get(term))
+
+    def keep_term(self, term, region_name, known_zero):
+        """Whether a physics term goes into the form (see physics_terms); records drops"""
+        setting = self.config["physics_terms"][term]
+        keep = setting is True or (setting == "auto" and not known_zero)
+        if not keep and f"{region_name}:{term}" not in self.dropped_terms:
+            self.dropped_terms.append(f"{region_name}:{term}")
+        return keep
+
+    @cached_property
+    def phi_is_zero(self):
+        """Phi vanishes on every rank (checked once, when the forms are built)"""
+        local = float(np.max(np.abs(self.Phi.x.array))) if self.Phi.x.array.size else 0.0
+        return self.comm.allreduce(local, op=MPI.MAX) == 0.0
+
+    @cached_property
+    def phi_hessian_is_zero(self):
+        """The Hessian of Phi vanishes cell-wise (P1 on affine simplices)"""
+        return (self.Phi.function_space.ufl_element().embedded_superdegree <= 1
+                and self.mesh.topology.cell_type == dmesh.CellType.triangle)
+
+    def build_region_form(self, region_id, Ci_trial, Cn_func, w_test, species=None, split=None,
+                          Phi=None):
+        """
+        Build weak form for a specific region, with the constants of a species
+        group (default: the first species) as fem.Constants. With a split dict,
+        the bilinear form is also appended as a_reg = M/dt + K to split["M"]
+        and split["K"]. Phi may be an expression (e.g. concentration-coupled);
+        terms are then only pruned on the constants.
+        """
+        cfg = self.config
+        species = species or self.species_names[0]
+        dx, _ = self.measures
+        dt_const = self.dt_const
+        frozen_phi = Phi is None
+        Phi = self.Phi if frozen_phi else Phi
+        u_adv_vector = self.u_adv_vector
+
+        region_name = REGION_INTERVALS[region_id][0]
+        rc = self.region_constant_fields(species)[region_name]
+        Pe_val = rc["Pe"]
+        gamma_val = rc["gamma"]
+        Ri_val = rc["Ri"]
         
-        # Solve in-place (no assignment needed)
-        problem_darcy.solve()
+        # Time term (ALWAYS INCLUDED); source term unless Ri == 0
+        dx_time = self.term_measure(dx, region_id, "time")
+        a_time = (Ci_trial / dt_const) * w_test * dx_time
+        L_time = (Cn_func / dt_const) * w_test * dx_time
+        has_source = self.keep_term("source", region_name, float(Ri_val.value) == 0.0)
+        L_source = Ri_val * w_test * dx_time if has_source else None
         
-        # Extract velocity magnitude for logging using the robust split/collapse method
+        # ----------------------------------------------------
+        # Transport Terms (Diffusion, Migration, Advection)
+        # ----------------------------------------------------
         
-        # 1. Get the velocity subspace function (sol_darcy.sub(0))
-        # 2. Collapse it to get a Function object (u_darcy_func) that lives only in V_vel
-        u_darcy_func = sol_darcy.sub(0).collapse()
+        # Diffusion term
+        a_diff = (1.0 / Pe_val) * (
+            gamma_val**2 * ufl.grad(Ci_trial)[0] * ufl.grad(w_test)[0] +
+            ufl.grad(Ci_trial)[1] * ufl.grad(w_test)[1]
+        ) * self.term_measure(dx, region_id, "diffusion")
         
-        # u_darcy_func.x.array now contains only the velocity DOFs, structured as (N_vel, 3)
-        # Reshape to (N_dofs_per_component, 3) and take the (x, y) components for magnitude
-        velocity_array = u_darcy_func.x.array.reshape(-1, mesh_domain.geometry.dim)
+        if region_id != 2: # Anode (1) and Cathode (3) - Full transport
+            
+            # Migration coefficients - Using Pe_max for migration flux term (user specified)
+            coeff_mig = self.global_constants["z_i_c"] / self.global_constants["Pe_max"]
+            
+            # Advection term
+            a_adv = ufl.dot(u_adv_vector, ufl.grad(Ci_trial)) * w_test * self.term_measure(
+                dx, region_id, "advection")
+            
+            # Total Transport Term
+            a_transport = a_diff + a_adv
+
+            # Migration terms (using user's linearization), skipped while Phi == 0
+            if self.keep_term("migration", region_name,
+                              cfg["z_i_c"] == 0.0 or (frozen_phi and self.phi_is_zero)):
+                gradPhi = ufl.grad(Phi)
+                a_mig_b = - coeff_mig * (
+                    gamma_val**2 * ufl.grad(Ci_trial)[0] * gradPhi[0] +
+                    ufl.grad(Ci_trial)[1] * gradPhi[1]
+                ) * w_test * self.term_measure(dx, region_id, "migration")
+                a_transport += a_mig_b
+                self.uses_phi = True
+
+                if self.keep_term("migration_hessian", region_name, frozen_phi and self.phi_hessian_is_zero):
+                    HessianPhi = ufl.grad(ufl.grad(Phi))
+                    d2Phi_dx2 = HessianPhi[0, 0]
+                    d2Phi_dy2 = HessianPhi[1, 1]
+                    a_mig_c = - coeff_mig * Ci_trial * (
+                        gamma_val**2 * d2Phi_dx2 + d2Phi_dy2
+                    ) * w_test * self.term_measure(dx, region_id, "migration")
+                    a_transport += a_mig_c
+            
+            # ----------------------------------------------------
+            # SUPG Stabilization Term (New: using user's coth formula)
+            # ----------------------------------------------------
+            if cfg["supg_tau"] == "cellwise":
+                # Same formula, precomputed per cell (see compute_cellwise_supg_tau)
+                tau = self.tau_field(species)
+            else:
+                # Cell size (h)
+                h = ufl.CellDiameter(self.mesh)
+
+                # Magnitude of Advection Velocity |a|. Added 1e-12 for numerical stability
+                # to prevent division by zero when U=0 (at x=1.0, cathode top).
+                U = ufl.sqrt(ufl.dot(u_adv_vector, u_adv_vector) + 1e-12)
+
+                # Effective Diffusivity Deff (non-dimensional)
+                D_eff = (1.0 / Pe_val)
+
+                # Cell Peclet Number: Pe_cell = |a| * h / (2 * D_eff)
+                Pe_cell = U * h / (2.0 * D_eff)
+
+                # tau_SUPG = (h / (2*|a|)) * (coth(Pe_cell) - 1/Pe_cell)
+                # coth(x) = cosh(x) / sinh(x)
+                coth_Pe_cell = ufl.cosh(Pe_cell) / ufl.sinh(Pe_cell)
+                tau = (h / (2.0 * U)) * (coth_Pe_cell - 1.0 / Pe_cell)
+            
+            # SUPG Test Function Component: tau * (a . grad(w))
+            grad_w_dot_u = ufl.dot(u_adv_vector, ufl.grad(w_test))
+            w_stab = tau * grad_w_dot_u 
+
+            # The stabilization form F_stab = integral( Residual * w_stab ) dV
+            
+            # Residual LHS operator on Ci (Approximated: Time + Advection)
+            # We simplify the residual to focus on the time and advection terms 
+            # for robust stabilization, consistent with the standard SUPG theory.
+            a_res_operator = (Ci_trial / dt_const) + ufl.dot(u_adv_vector, ufl.grad(Ci_trial))
+            dx_supg = self.term_measure(dx, region_id, "supg")
+            a_stab = a_res_operator * w_stab * dx_supg
+
+            # Residual RHS terms (Known terms Cn, Ri, etc.)
+            L_res_operator = (Cn_func / dt_const) + ufl.dot(u_adv_vector, ufl.grad(Cn_func))
+            if has_source:
+                L_res_operator = L_res_operator - Ri_val
+            L_stab = L_res_operator * w_stab * dx_supg
+            
+            a_reg = a_time + a_transport + a_stab
+            L_reg = L_time + L_stab
+            if split is not None:
+                split["M"].append(Ci_trial * w_test * dx_time + Ci_trial * w_stab * dx_supg)
+                split["K"].append(a_transport + ufl.dot(u_adv_vector, ufl.grad(Ci_trial)) * w_stab * dx_supg)
+            
+        else: # Membrane (Region 2) - Diffusion ONLY (Requested Change)
+            # Migration and Advection are set to zero
+            a_transport = a_diff # Changed from 0 to a_diff
+            
+            a_reg = a_time + a_transport
+            L_reg = L_time
+            if split is not None:
+                split["M"].append(Ci_trial * w_test * dx_time)
+                split["K"].append(a_transport)
+
+        if L_source is not None:
+            L_reg += L_source
+        return a_reg, L_reg
+
+    @cached_property
+    def species_forms(self):
+        """Compiled species forms (a, L) of the first species"""
+        return self.build_species_forms(self.c_n, self.species_names[0])
+
+    def build_species_forms(self, c_n, species, unknown=None):
+        """
+        Compiled species forms (a, L) with the constants of a species group and
+        c_n as the previous step. With adaptive_dt, the dt-independent parts a = M/dt + K
+        are compiled too and kept in self.species_split[a].
+        With unknown (species_solver = "newton"), returns the residual and
+        Jacobian (F, J) of a(unknown; unknown) - L instead, where the migration
+        terms see Phi + phi_coupling * unknown.
+        """
+        self.log(f"[{datetime.now().isoformat()}] Building species weak form...")
+        mesh_domain = self.mesh
+        _, ds = self.measures
+        x = ufl.SpatialCoordinate(mesh_domain)
+        # Define advection vector once (u=[0, (1-x)^2])
+        self.u_adv_vector = ufl.as_vector((0.0, (1.0 - x[0])**2, 0.0))
+
+        # Trial and test functions for species
+        Ci = ufl.TrialFunction(self.V)
+        w = ufl.TestFunction(self.V)
+
+        # Build total weak form by summing over regions
+        a_total = None
+        L_total = None
+        split = {"M": [], "K": []} if self.config["adaptive_dt"] and unknown is None else None
+        Phi = None
+        if unknown is not None:
+            # Built even for phi_coupling == 0, so set_parameters can change it
+            Phi = self.Phi + self.phi_coupling * unknown
+        for rid in [1, 2, 3]:
+            a_reg, L_reg = self.build_region_form(rid, Ci, c_n, w, species, split=split, Phi=Phi)
+            if a_total is None:
+                a_total = a_reg
+                L_total = L_reg
+            else:
+                a_total += a_reg
+                L_total += L_reg
+
+        # Add the boundary integral (Outflow BC) ONCE after the loop
+        n = ufl.FacetNormal(mesh_domain)
+        h_boundary = ufl.FacetArea(mesh_domain)  # Characteristic boundary size
+        if not hasattr(self, "alpha_outflow"):
+            self.alpha_outflow = fem.Constant(mesh_domain, ScalarType(0.01))  # Small penalty
+
+        # Penalty for deviation from pure advection
+        a_outflow_penalty = self.alpha_outflow * h_boundary * (
+            ufl.dot(ufl.grad(Ci), n) * ufl.dot(ufl.grad(w), n)
+        ) * (self.term_measure(ds, 1, "outflow") + self.term_measure(ds, 3, "outflow"))
+
+        a_total += a_outflow_penalty
+        self.log(f"  Added Convective Outflow BC term to the top boundaries: Anode (ds(1)) and Cathode (ds(3)).")
+        if self.dropped_terms:
+            self.log(f"  Dropped zero/inactive terms: {', '.join(self.dropped_terms)}")
+
+        if unknown is not None:
+            F = ufl.action(a_total, unknown) - L_total
+            J = ufl.derivative(F, unknown, Ci)
+            self.species_ufl = (J, F)
+            with self.perf.phase("form_compilation"):
+                return self.compile_form(F), self.compile_form(J)
+
+        # Keep the UFL forms (kernel size reports), then compile
+        self.species_ufl = (a_total, L_total)
+        with self.perf.phase("form_compilation"):
+            a, L = self.compile_form(a_total), self.compile_form(L_total)
+            if split is not None:
+                self.species_split[a] = (
+                    self.compile_form(sum(split["M"][1:], split["M"][0])),
+                    self.compile_form(sum(split["K"][1:], split["K"][0]) + a_outflow_penalty))
+        return a, L
+
+    @cached_property
+    def diagnostic_forms(self):
+        """
+        Compiled scalar forms per species:
+        - mass:<species>:<region>, the integral of c over dx(1..3)
+        - outflow:<species>:<anode|cathode>, the advective flux c u.n over ds(1) / ds(3)
+        - interface:<species>:<anode|cathode>, the diffusive flux -(gamma^2/Pe) dc/dx
+          (membrane constants, positive towards the cathode) through x = 0.4 / 0.6
+        """
+        mesh_domain = self.mesh
+        dx, ds = self.measures
+        dS = ufl.Measure("dS", domain=mesh_domain, subdomain_data=tag_interface_facets(
+            mesh_domain, [membrane_anode_interface, membrane_cathode_interface]))
+        n = ufl.FacetNormal(mesh_domain)
+        forms = {}
+        with self.perf.phase("form_compilation"):
+            for name, state in self.species.items():
+                c = state["c"]
+                for rid, (region_name, _, _) in REGION_INTERVALS.items():
+                    forms[f"mass:{name}:{region_name}"] = self.compile_form(c * dx(rid))
+                for rid in (1, 3):
+                    forms[f"outflow:{name}:{REGION_INTERVALS[rid][0]}"] = self.compile_form(
+                        c * ufl.dot(self.u_adv_vector, n) * ds(rid))
+                rc = self.region_constant_fields(name)["membrane"]
+                flux_x = -(rc["gamma"]**2 / rc["Pe"]) * ufl.avg(ufl.grad(c))[0]
+                for tag, side in ((1, "anode"), (2, "cathode")):
+                    forms[f"interface:{name}:{side}"] = self.compile_form(flux_x * dS(tag))
+        return forms
+
+    def write_diagnostics(self, step, t):
+        """Scalar diagnostics of the current c (collective), logged as region masses"""
+        with self.perf.phase("diagnostics"):
+            values = self.diagnostics.write(step, t)
+        for name in self.species_names:
+            masses = ", ".join(f"{region_name}={values[f'mass:{name}:{region_name}']:.6e}"
+                               for region_name, _, _ in REGION_INTERVALS.values())
+            self.log(f"  Mass ({name}): {masses}")
+        return values
+
+    # ------------------------------
+    # Darcy problem on the membrane submesh (for visualization only)
+    # ------------------------------
+    @cached_property
+    def darcy(self):
+        """Submesh, mixed space, solution, BCs and compiled forms of the Darcy problem"""
+        self.log(f"[{datetime.now().isoformat()}] Setting up Darcy problem in membrane...")
+        cfg = self.config
+        mesh_domain, tdim = self.mesh, self.tdim
+        mt, _ = self.tags
+
+        # Extract membrane cells (tag 2) into a submesh so the mixed system only
+        # carries membrane DOFs instead of the whole unit square
+        membrane_cells = mt.find(2)
+        membrane_mesh, membrane_to_parent, _, _ = dmesh.create_submesh(mesh_domain, tdim, membrane_cells)
+        num_membrane_cells = (membrane_mesh.topology.index_map(tdim).size_local
+                              + membrane_mesh.topology.index_map(tdim).num_ghosts)
+
+        # Create mixed function space for Darcy (u: velocity, p: pressure)
+        P2_vec = basix_element("Lagrange", membrane_mesh.topology.cell_name(), 2,
+                               shape=(membrane_mesh.geometry.dim,))
+        P1 = basix_element("Lagrange", membrane_mesh.topology.cell_name(), 1)
+        ME = mixed_element([P2_vec, P1])
+        W = fem.functionspace(membrane_mesh, ME)
+
+        self.log(f"  Membrane submesh cells: {membrane_mesh.topology.index_map(tdim).size_global}")
+        self.log(f"  Mixed space DOFs: {W.dofmap.index_map.size_global * W.dofmap.index_map_bs}")
+
+        # --- Setup Gauge Pressure BC (Essential for Darcy well-posedness) ---
+        # The membrane bottom-left corner (0.4, 0) is a vertex of the submesh, so the
+        # P1 pressure has exactly one DOF there on every rank that holds it
+        V_p_subspace = W.sub(1)
+        V_p_collapsed, _ = V_p_subspace.collapse()
+        dofs_p = fem.locate_dofs_geometrical((V_p_subspace, V_p_collapsed), membrane_p_point)
+        p_gauge = fem.Function(V_p_collapsed)
+        bcs_darcy = [fem.dirichletbc(p_gauge, dofs_p, V_p_subspace)]
+        if global_count(self.comm, dofs_p[1] < V_p_collapsed.dofmap.index_map.size_local) > 0:
+            self.log(f"  Applied Darcy BC: Fixed pressure at the membrane bottom-left corner.")
+        else:
+            self.log("  Warning: Could not locate pressure DOF for gauge fixing.")
+
+        # Trial and test functions
+        (u_trial, p_trial) = ufl.TrialFunctions(W)
+        (v_test, q_test) = ufl.TestFunctions(W)
+
+        # Darcy weak form (the submesh is the membrane region, so integrate over all of it)
+        Re_val = fem.Constant(membrane_mesh, ScalarType(cfg["Re_val"]))
+        Da_val = fem.Constant(membrane_mesh, ScalarType(cfg["Da_val"]))
+        dx_mem = ufl.Measure("dx", domain=membrane_mesh)
+        a_darcy = (
+            (1.0 / Re_val) * ufl.inner(ufl.grad(u_trial), ufl.grad(v_test)) * dx_mem +
+            (1.0 / (Re_val * Da_val)) * ufl.inner(u_trial, v_test) * dx_mem -
+            ufl.div(v_test) * p_trial * dx_mem -
+            ufl.div(u_trial) * q_test * dx_mem
+        )
+
+        # FIXED: Corrected constant to 3 components (0.0, 0.0, 0.0)
+        f_darcy = fem.Constant(membrane_mesh, ScalarType((0.0, 0.0, 0.0)))
+        L_darcy = ufl.inner(f_darcy, v_test) * dx_mem
+
+        # Parent-mesh fields for output: zero outside the membrane
+        V_u_parent = fem.functionspace(mesh_domain, basix_element(
+            "Lagrange", mesh_domain.topology.cell_name(), 2, shape=(mesh_domain.geometry.dim,)))
+        V_p_parent = fem.functionspace(mesh_domain, basix_element(
+            "Lagrange", mesh_domain.topology.cell_name(), 1))
+
+        with self.perf.phase("form_compilation"):
+            a_darcy_form, L_darcy_form = self.compile_form(a_darcy), self.compile_form(L_darcy)
+
+        return {
+            "mesh": membrane_mesh,
+            "sub_cells": np.arange(num_membrane_cells, dtype=np.int32),
+            "to_parent": np.asarray(membrane_to_parent, dtype=np.int32),
+            "W": W,
+            "sol": fem.Function(W),
+            "bcs": bcs_darcy,
+            "f": f_darcy,
+            "Re": Re_val,
+            "Da": Da_val,
+            "a": a_darcy_form,
+            "L": L_darcy_form,
+            "u_parent": fem.Function(V_u_parent, name="darcy_velocity"),
+            "p_parent": fem.Function(V_p_parent, name="darcy_pressure"),
+        }
+
+    def map_darcy_to_parent(self):
+        """Interpolate the submesh (u, p) solution onto the parent-mesh output fields"""
+        darcy = self.darcy
+        u_sub = darcy["sol"].sub(0).collapse()
+        p_sub = darcy["sol"].sub(1).collapse()
+        darcy["u_parent"].interpolate(u_sub, cells0=darcy["sub_cells"], cells1=darcy["to_parent"])
+        darcy["p_parent"].interpolate(p_sub, cells0=darcy["sub_cells"], cells1=darcy["to_parent"])
+        darcy["u_parent"].x.scatter_forward()
+        darcy["p_parent"].x.scatter_forward()
+        return u_sub
+
+    # ------------------------------
+    # Parameter updates (no recompilation)
+    # ------------------------------
+    SWEEP_PARAMETERS = ("region_constants", "z_i_c", "Pe_max", "Re_val", "Da_val", "phi_coupling")
+
+    def set_parameters(self, params):
+        """
+        Change region_constants / z_i_c / Pe_max / Re_val / Da_val in place,
+        relative to the configuration the Simulation was built with (earlier
+        calls do not carry over): every fem.Constant (and the cell-wise tau) is
+        set from it, the species operators are reassembled on the next solve
+        and Darcy re-solves if Re/Da changed.
+        """
+        unknown = set(params) - set(self.SWEEP_PARAMETERS)
+        if unknown:
+            raise ValueError(f"Cannot change {sorted(unknown)} without rebuilding the forms "
+                             f"(allowed: {', '.join(self.SWEEP_PARAMETERS)})")
+        cfg = make_config(copy.deepcopy(params), base=self._base_config)
+        self.check_phi_coupling(cfg)
+        self.config = cfg
+
+        for species, fields in self._region_constants.items():
+            for region_name, values in self.species_region_constants(species).items():
+                if float(values["Ri"]) != 0.0 and f"{region_name}:source" in self.dropped_terms:
+                    raise ValueError(f"Ri of {region_name} is nonzero but the source term was pruned; "
+                                     "build with physics_terms source=True")
+                for key, value in values.items():
+                    fields[region_name][key].value = value
+            if species in self._tau_cache:
+                mt, _ = self.tags
+                compute_cellwise_supg_tau(self.mesh, mt, self.species_region_constants(species),
+                                          tau=self._tau_cache[species])
+        if "global_constants" in self.__dict__:
+            for key, const in self.global_constants.items():
+                const.value = cfg[key]
+        if "phi_coupling" in self.__dict__:
+            self.phi_coupling.value = cfg["phi_coupling"]
+        if "darcy" in self.__dict__:
+            self.darcy["Re"].value = cfg["Re_val"]
+            self.darcy["Da"].value = cfg["Da_val"]
+        for solver in self.species_solvers:
+            solver.mark_operator_dirty()
+
+    def check_phi_coupling(self, cfg):
+        """A nonzero phi_coupling needs the Newton forms with the migration terms kept"""
+        if cfg["phi_coupling"] == 0.0:
+            return
+        if cfg["species_solver"] != "newton":
+            raise ValueError("phi_coupling is only used with species_solver='newton' "
+                             "(the linear solve keeps Phi frozen)")
+        pruned = [term for term in self.dropped_terms if term.endswith(":migration")]
+        if pruned:
+            raise ValueError(f"phi_coupling is nonzero but the migration terms were pruned ({', '.join(pruned)}); "
+                             "build with physics_terms migration=True")
+
+    def reset(self, params=None):
+        """
+        Back to t = 0, the initial conditions and the base parameters with params
+        applied (see set_parameters); forms, solvers and Darcy factors are kept
+        """
+        if params or self.config != self._base_config:
+            self.set_parameters(params or {})
+        for name, state in self.species.items():
+            state["c_n"].x.array[:] = self.species_initial_condition(name).x.array
+            state["c"].x.array[:] = state["c_n"].x.array
+        self.n, self.t, self.steady = 0, 0.0, False
+        self.set_dt(self.T / self.num_steps)
+        for solver in self.species_solvers:
+            for guess in solver.guesses:
+                guess.destroy()
+
+    def warmup(self):
+        """
+        Compile every form this configuration uses (species forms of each group,
+        the M/K split when adaptive, or the Newton F/J of each species; Darcy;
+        the scalar diagnostics when enabled) into the JIT cache, without solving
+        """
+        if self.config["species_solver"] == "newton":
+            for name, state in self.species.items():
+                self.build_species_forms(state["c_n"], name, unknown=state["c"])
+        else:
+            for names in self.species_groups:
+                if names[0] == self.species_names[0]:
+                    self.species_forms
+                else:
+                    self.build_species_forms(self.species[names[0]]["c_n"], names[0])
+        self.darcy
+        if self.config["diagnostics_file"] is not None:
+            self.diagnostic_forms
+        return self.perf.time("form_compilation")
+
+    # ------------------------------
+    # Setup, time stepping and finalization
+    # ------------------------------
+    def setup(self):
+        """Build everything needed for time stepping and write the initial state"""
+        if self.is_setup:
+            return self
+        cfg = self.config
+        self.create_species_solvers()
+        darcy = self.darcy
+
+        self.log(f"[{datetime.now().isoformat()}] Starting time-stepping loop...")
+        self.log(f"  Total time: {self.T}s, Steps: {self.num_steps}, dt: {self.dt}s")
+
+        # Darcy is stationary: its LU factors and solution are cached across steps
+        try:
+            self.darcy_stage = DarcyStage(darcy["a"], darcy["L"], darcy["bcs"], darcy["sol"],
+                                          cfg["darcy_petsc_options"],
+                                          solve_every=cfg["darcy_solve_every"],
+                                          reuse_factorization=cfg["darcy_reuse_factorization"],
+                                          watch=[darcy["f"], darcy["Re"], darcy["Da"]], report=self.perf)
+        except Exception as e:
+            self.darcy_stage = None
+            self.log(f"  Warning: Darcy setup failed - {e}", all_ranks=True)
+
+        # Visualization runs in a background process pool (or inline if viz_async is False)
+        if cfg["viz_enabled"] and cfg["viz_async"]:
+            try:
+                self.visualizer = AsyncVisualizer(self.mesh, every=cfg["viz_every"],
+                                                  max_pending=cfg["viz_max_pending"],
+                                                  workers=cfg["viz_workers"])
+            except Exception as e:
+                self.log(f"  Warning: Background visualization unavailable, rendering inline - {e}",
+                         all_ranks=True)
+
+        # Checkpoints; a restart resumes from the latest one before any output is written
+        if cfg["checkpoint_every"] or cfg["restart"]:
+            self.checkpointer = Checkpointer(self.comm, cfg["checkpoint_dir"], keep=cfg["checkpoint_keep"])
+        if cfg["restart"]:
+            self.restore_checkpoint()
+
+        # Time-series writer: mesh once, then concentration and Darcy (u, p) per step
+        # (a restarted run starts new files, so the earlier series is kept)
+        if cfg["output_format"] is not None:
+            with self.perf.phase("output"):
+                species_fields = [state["c"] for state in self.species.values()]
+                self.writer = TimeSeriesWriter(self.mesh, species_fields + [darcy["u_parent"], darcy["p_parent"]],
+                                               output_dir=cfg["output_dir"], fmt=cfg["output_format"],
+                                               engine=cfg["vtx_engine"],
+                                               suffix=f"_restart{self.n:06d}" if self.n else "")
+                self.writer.write(self.t)
+
+        # Scalar diagnostics, streamed per step (a restarted run starts a new file)
+        if cfg["diagnostics_file"] is not None:
+            root, ext = os.path.splitext(cfg["diagnostics_file"])
+            path = f"{root}_restart{self.n:06d}{ext}" if self.n else cfg["diagnostics_file"]
+            self.diagnostics = ScalarDiagnostics(self.comm, self.diagnostic_forms, path=path)
+            self.write_diagnostics(self.n, self.t)
+
+        # Visualize initial condition
+        if self.n == 0:
+            self.export_frame(0, "conc_t00", self.c_n, f"{self.species_names[0]} concentration t=0.000s",
+                              force=True)
+        self.is_setup = True
+        return self
+
+    def checkpoint_functions(self):
+        """Functions stored in a checkpoint, by name"""
+        functions = {f"c_n:{name}": state["c_n"] for name, state in self.species.items()}
+        functions["Phi"] = self.Phi
+        if self.darcy_stage is not None:
+            functions["darcy_sol"] = self.darcy["sol"]
+        return functions
+
+    def save_checkpoint(self):
+        with self.perf.phase("checkpoint"):
+            path = self.checkpointer.save(self.n, self.checkpoint_functions(), {
+                "t": self.t, "dt": self.dt, "steady": self.steady, "u_mag_max": self.u_mag_max,
+                "darcy_solved": self.darcy_stage is not None and self.darcy_stage.num_solves > 0,
+                "created": datetime.now().isoformat(),
+            })
+        self.log(f"  Checkpoint written to {path}")
+
+    def restore_checkpoint(self):
+        """Resume from the latest checkpoint: species state, Darcy solution, t, step and dt"""
+        path = self.checkpointer.latest()
+        if path is None:
+            self.log(f"  No checkpoint in {self.config['checkpoint_dir']}, starting from t=0")
+            return
+        with self.perf.phase("checkpoint"):
+            functions = self.checkpoint_functions()
+            meta = self.checkpointer.load(path, functions)
+            for state in self.species.values():
+                state["c"].x.array[:] = state["c_n"].x.array
+        self.n, self.t, self.steady = meta["step"], meta["t"], meta["steady"]
+        self.set_dt(meta["dt"])
+        # The restored Darcy solution is reused: no assembly or LU factorization
+        if meta["darcy_solved"] and "darcy_sol" in functions:
+            self.darcy_stage.mark_solved()
+            self.map_darcy_to_parent()
+            self.u_mag_max = meta["u_mag_max"]
+        self.log(f"  Restarted from {path}: step {self.n}, t = {self.t:.4f}s, dt = {self.dt:.4e}s")
+
+    def create_species_solvers(self):
+        """One solver per species group; a group of several species shares A and the PC"""
+        cfg = self.config
+        species = self.species
+        self.species_solvers = []
+        if cfg["species_solver"] == "newton":
+            # One SNES per species: each has its own unknown in F and J
+            for name, state in species.items():
+                prefix = "species_" if not self.species_solvers else f"species{len(self.species_solvers)}_"
+                F, J = self.build_species_forms(state["c_n"], name, unknown=state["c"])
+                solver = NonlinearSpeciesSolver(F, J, state["bcs"], state["c"], cfg["petsc_options"],
+                                                cfg["snes_options"], dt_const=self.dt_const, prefix=prefix,
+                                                report=self.perf)
+                solver.names = [name]
+                self.species_solvers.append(solver)
+            self.species_solver = self.species_solvers[0]
+            self.check_phi_coupling(cfg)
+            self.log(f"  Species solve: Newton (SNES), lag Jacobian={cfg['snes_options']['snes_lag_jacobian']}, "
+                     f"lag PC={cfg['snes_options']['snes_lag_preconditioner']}")
+            return
+        self.check_phi_coupling(cfg)
+        for names in self.species_groups:
+            if len(names) == 1 and names[0] == self.species_names[0]:
+                a, L = self.species_forms
+                c_n_form = self.c_n
+            elif len(names) == 1:
+                c_n_form = species[names[0]]["c_n"]
+                a, L = self.build_species_forms(c_n_form, names[0])
+            else:
+                # The group's forms read c_n from a work function, filled per species
+                c_n_form = fem.Function(self.V)
+                c_n_form.x.array[:] = species[names[0]]["c_n"].x.array
+                a, L = self.build_species_forms(c_n_form, names[0])
+
+            # Species operator is assembled once and reused while dt_const and Phi are unchanged
+            # (Phi is only watched when the migration terms are in the form)
+            prefix = "species_" if not self.species_solvers else f"species{len(self.species_solvers)}_"
+            split = self.species_split.get(a)
+            solver = BatchedSpeciesSolver(
+                a, L, [species[name]["bcs"] for name in names], [species[name]["c"] for name in names],
+                [species[name]["c_n"] for name in names], c_n_form, cfg["petsc_options"],
+                block=cfg["species_block_solve"], dt_const=self.dt_const,
+                Phi=self.Phi if self.uses_phi else None, prefix=prefix, report=self.perf,
+                initial_guess=cfg["species_initial_guess"], guess_basis=cfg["species_guess_basis"],
+                split=split)
+            solver.names = names
+            self.species_solvers.append(solver)
+            if len(self.species_names) > 1:
+                self.log(f"  Species group {', '.join(names)}: one operator, "
+                         f"{'block' if solver.block else 'sequential'} solve")
+        self.species_solver = self.species_solvers[0]
+
+    def export_frame(self, step, image_name, func, title, force=False):
+        """Render a concentration frame in the background, or inline as a fallback"""
+        cfg = self.config
+        if not cfg["viz_enabled"]:
+            return
+        try:
+            with self.perf.phase("visualization"):
+                if self.visualizer is not None:
+                    if self.visualizer.submit(step, image_name, func, title, force=force):
+                        self.log(f"  Queued visualization: assets/{image_name}.html")
+                elif force or step % cfg["viz_every"] == 0:
+                    visualize_layered_solution(image_name, self.mesh, func, title=title)
+                    self.log(f"  Exported visualization: assets/{image_name}.html")
+        except Exception as e:
+            self.log(f"  Warning: Visualization failed - {e}", all_ranks=True)
+
+    def set_dt(self, dt):
+        """
+        Change the time step; linear solvers recombine A = K + M/dt and Newton
+        solvers rebuild their (possibly lagged) Jacobian on their next solve
+        """
+        self.dt = float(dt)
+        self.dt_const.value = self.dt
+
+    def solve_species(self):
+        """One backward Euler step of every species from c_n into c"""
+        for solver in self.species_solvers:
+            solver.solve()
+            label = "species" if len(self.species_solvers) == 1 else "species:" + ",".join(solver.names)
+            ksp_stats = self.perf.record_ksp(self.n, label, solver.ksp, snes=getattr(solver, "snes", None))
+            newton = (f"newton its={ksp_stats['nonlinear_iterations']}, linear "
+                      if "nonlinear_iterations" in ksp_stats else "")
+            self.log(f"  Species KSP ({', '.join(solver.names)}): {newton}its={ksp_stats['iterations']}, "
+                     f"||r||={ksp_stats['residual_norm']:.3e}, reason={ksp_stats['reason']}")
+
+    def species_change(self):
+        """max over species of ||c - c_n|| / ||c_n|| (owned DOFs, all ranks)"""
+        return max(relative_difference(state["c"].x.petsc_vec, state["c_n"].x.petsc_vec)
+                   for state in self.species.values())
+
+    def solve_species_adaptive(self):
+        """
+        Step doubling: solve one dt step and two dt/2 steps, estimate the local
+        error from their difference, retry with a smaller dt until it is below
+        dt_tol (or dt_min is reached). Leaves the two-half-step solution in c
+        and returns (dt taken, error estimate); self.dt becomes the next dt.
+        """
+        cfg = self.config
+        dt_min = cfg["dt_min"] or self.T / self.num_steps * 1e-3
+        dt_max = cfg["dt_max"] or self.T
+        states = list(self.species.values())
+        c_n_saved = [state["c_n"].x.petsc_vec.copy() for state in states]
+        while True:
+            dt = min(self.dt, self.T - self.t)
+            self.set_dt(dt)
+            self.solve_species()
+            full = [state["c"].x.petsc_vec.copy() for state in states]
+
+            self.set_dt(dt / 2.0)
+            self.solve_species()
+            for state in states:
+                state["c_n"].x.array[:] = state["c"].x.array
+            self.solve_species()
+            for state, saved in zip(states, c_n_saved):
+                saved.copy(state["c_n"].x.petsc_vec)
+                state["c_n"].x.scatter_forward()
+
+            err = max(relative_difference(state["c"].x.petsc_vec, u_full)
+                      for state, u_full in zip(states, full))
+            for vec in full:
+                vec.destroy()
+            factor = cfg["dt_safety"] * np.sqrt(cfg["dt_tol"] / err) if err > 0 else cfg["dt_grow"]
+            factor = min(max(factor, cfg["dt_shrink"]), cfg["dt_grow"])
+            if err <= cfg["dt_tol"] or dt <= dt_min:
+                break
+            self.log(f"  Rejected dt={dt:.4e} (error {err:.3e}), retrying")
+            self.set_dt(max(dt * factor, dt_min))
+        for vec in c_n_saved:
+            vec.destroy()
+        self.set_dt(min(max(dt * factor, dt_min), dt_max))
+        return dt, err
+
+    def finished(self):
+        if self.steady:
+            return True
+        if self.config["adaptive_dt"]:
+            return self.t >= self.T * (1.0 - 1e-12)
+        return self.n >= self.num_steps
+
+    def step(self):
+        """Advance one time step; returns the step diagnostics"""
+        self.setup()
+        cfg = self.config
+        self.n += 1
+        n = self.n
+        if cfg["adaptive_dt"]:
+            self.log(f"\n[{datetime.now().isoformat()}] Time step {n}: t = {self.t:.4f}s, "
+                     f"trying dt = {self.dt:.4e}s")
+            dt_taken, err = self.solve_species_adaptive()
+            self.t += dt_taken
+            self.log(f"  Accepted dt={dt_taken:.4e}s (error {err:.3e}) -> t = {self.t:.4f}s, "
+                     f"next dt={self.dt:.4e}s")
+        else:
+            self.t = self.n * self.dt
+            self.log(f"\n[{datetime.now().isoformat()}] Time step {n}/{self.num_steps}: t = {self.t:.4f}s")
+            # Solve species transport equations (reuses A and the preconditioner per group)
+            self.solve_species()
+        t_curr, c = self.t, self.c
+
+        if cfg["steady_tol"] is not None:
+            change = self.species_change()
+            self.steady = change < cfg["steady_tol"]
+            self.log(f"  Relative change ||c - c_n||/||c_n|| = {change:.3e}"
+                     + (" (steady state reached)" if self.steady else ""))
         
-        # Calculate magnitude (assuming 2D solution in x, y)
-        u_mag = np.sqrt(np.sum(velocity_array[:, :2]**2, axis=1))
+        # Compute min/max concentration over owned DOFs, reduced across ranks
+        species_range = {name: global_min_max(state["c"]) for name, state in self.species.items()}
+        c_min, c_max = species_range[self.species_names[0]]
+        for name, (s_min, s_max) in species_range.items():
+            self.log(f"  Concentration ({name}): min={s_min:.6f}, max={s_max:.6f}")
         
-        print(f"  Darcy velocity (membrane): max magnitude={np.max(u_mag):.6e}")
+        scalars = None
+        if self.diagnostics is not None and (n % cfg["diagnostics_every"] == 0 or self.finished()):
+            scalars = self.write_diagnostics(n, t_curr)
+
+        # Solve Darcy in membrane (for visualization/logging only)
+        try:
+            # Stationary problem: solved/factorized once, then reused per darcy_solve_every
+            if self.darcy_stage is None:
+                raise RuntimeError("Darcy stage unavailable")
+            if self.darcy_stage.update(n):
+                self.perf.record_ksp(n, "darcy", self.darcy_stage.ksp)
+                # Map (u, p) back to the parent mesh; the collapsed submesh velocity
+                # (u_darcy_func) is reused for logging
+                u_darcy_func = self.map_darcy_to_parent()
+
+                # u_darcy_func.x.array now contains only the velocity DOFs, structured as (N_vel, 3)
+                # Reshape to (N_dofs_per_component, 3) and take the (x, y) components for magnitude
+                velocity_array = u_darcy_func.x.array.reshape(-1, self.darcy["mesh"].geometry.dim)
+                velocity_array = velocity_array[:u_darcy_func.function_space.dofmap.index_map.size_local]
+
+                # Calculate magnitude (assuming 2D solution in x, y), max over all ranks
+                u_mag = np.sqrt(np.sum(velocity_array[:, :2]**2, axis=1))
+                self.u_mag_max = self.comm.allreduce(np.max(u_mag, initial=0.0), op=MPI.MAX)
+
+                self.log(f"  Darcy velocity (membrane): max magnitude={self.u_mag_max:.6e}")
+            else:
+                self.log(f"  Darcy velocity (membrane): max magnitude={self.u_mag_max:.6e} (reused)")
+
+        except Exception as e:
+            self.log(f"  Warning: Darcy solve skipped - {e}", all_ranks=True)
+
+        # Visualize concentration (every viz_every steps, always the final one)
+        self.export_frame(n, f"conc_t{n:02d}", c, f"{self.species_names[0]} concentration t={t_curr:.3f}s",
+                          force=self.finished())
+
+        # Append this step to the time series (collective over all ranks)
+        if self.writer is not None:
+            with self.perf.phase("output"):
+                self.writer.write(t_curr)
         
-    except Exception as e:
-        print(f"  Warning: Darcy solve skipped - {e}")
-    
-    # Visualize concentration
-    image_name = f"conc_t{n:02d}"
+        # Update time level
+        for state in self.species.values():
+            state["c_n"].x.array[:] = state["c"].x.array
+            state["c_n"].x.scatter_forward()
+
+        if self.checkpointer is not None and cfg["checkpoint_every"] and (
+                n % cfg["checkpoint_every"] == 0 or self.finished()):
+            self.save_checkpoint()
+
+        return {"step": n, "t": t_curr, "c_min": c_min, "c_max": c_max, "darcy_u_max": self.u_mag_max,
+                "species": {name: {"min": s_min, "max": s_max} for name, (s_min, s_max) in species_range.items()},
+                "scalars": scalars}
+
+    def run(self):
+        """Run all remaining steps, finalize and return the per-phase timings"""
+        self.setup()
+        start_time = time.time()
+        while not self.finished():
+            self.step()
+        end_time = time.time()
+        return self.finalize(end_time - start_time)
+
+    def finalize(self, wall_time):
+        """Release solvers and output, log the summary and return the phase timings"""
+        cfg = self.config
+        for solver in self.species_solvers:
+            solver.destroy()
+        if self.visualizer is not None:
+            self.visualizer.close()
+        if self.writer is not None:
+            self.writer.close()
+        if self.diagnostics is not None:
+            self.diagnostics.close()
+        if self.darcy_stage is not None:
+            self.darcy_stage.destroy()
+        self.log(f"\n[{datetime.now().isoformat()}] Simulation completed!")
+        self.log(f"  Wall-clock time: {wall_time:.2f}s")
+        if self.steady:
+            self.log(f"  Steady state reached at t={self.t:.4f}s after {self.n} step(s)")
+        elif self.config["adaptive_dt"]:
+            self.log(f"  Adaptive time stepping: {self.n} step(s) to t={self.t:.4f}s")
+        dt_updates = sum(solver.num_dt_updates for solver in self.species_solvers)
+        if dt_updates:
+            self.log(f"  Species operator dt updates (A = K + M/dt, no reassembly): {dt_updates}")
+        self.log(f"  Species operator assemblies: "
+                 f"{sum(solver.num_assemblies for solver in self.species_solvers)} "
+                 f"({len(self.species_names)} species in {len(self.species_solvers)} group(s))")
+        species_log = [entry for entry in self.perf.ksp_log if entry["solver"].startswith("species")]
+        species_its = [entry["iterations"] for entry in species_log]
+        newton_its = [entry["nonlinear_iterations"] for entry in species_log if "nonlinear_iterations" in entry]
+        if newton_its:
+            self.log(f"  Species Newton iterations: total={sum(newton_its)}, "
+                     f"mean={np.mean(newton_its):.1f}, max={max(newton_its)}")
+        if species_its:
+            self.log(f"  Species KSP iterations ({cfg['species_initial_guess']} initial guess): "
+                     f"total={sum(species_its)}, mean={np.mean(species_its):.1f}, max={max(species_its)}")
+        if self.darcy_stage is not None:
+            self.log(f"  Darcy solves: {self.darcy_stage.num_solves}, "
+                     f"factorizations: {self.darcy_stage.num_factorizations}")
+        if self.visualizer is not None and self.visualizer.num_dropped:
+            self.log(f"  Visualization frames dropped (queue full): {self.visualizer.num_dropped}")
+        if self.writer is not None:
+            self.log(f"  Time series ({cfg['output_format']}) saved to {cfg['output_dir']}/ directory")
+        if self.diagnostics is not None:
+            self.log(f"  Scalar diagnostics ({self.diagnostics.num_rows} rows) saved to {self.diagnostics.path}")
+        if cfg["viz_enabled"]:
+            self.log(f"  All visualizations saved to assets/ directory")
+
+        # Per-phase breakdown (max over ranks: the slowest rank sets the wall clock)
+        perf = self.perf
+        phase_times = {
+            "assembly": perf.time("species_assembly") + perf.time("darcy_assembly"),
+            "solve": perf.time("species_solve") + perf.time("darcy_solve"),
+            "io": perf.time("output"),
+            "total": wall_time,
+        }
+        phase_times = {key: self.comm.allreduce(value, op=MPI.MAX) for key, value in phase_times.items()}
+        self.log("  Phase times (max over ranks): " + ", ".join(f"{k}={v:.3f}s" for k, v in phase_times.items()))
+        if cfg["timings_json"] is not None and self.comm.rank == 0:
+            with open(cfg["timings_json"], "w") as f:
+                json.dump({"ranks": self.comm.size, "mesh_scale": cfg["mesh_scale"],
+                           "cells": self.mesh.topology.index_map(self.tdim).size_global,
+                           "phases": phase_times}, f, indent=2)
+        if cfg["report_json"] is not None:
+            perf.write_json(cfg["report_json"], extra={
+                "cells": self.mesh.topology.index_map(self.tdim).size_global,
+                "dofs": self.V.dofmap.index_map.size_global,
+                "dropped_terms": self.dropped_terms,
+                "wall_time_s": phase_times["total"],
+            })
+            self.log(f"  Performance report written to {cfg['report_json']}")
+        return phase_times
+
+
+# ------------------------------
+# Command-line interface
+# ------------------------------
+def parse_key_value(text):
+    """'key=value' -> (key, value), with value parsed as JSON when possible"""
+    key, _, value = text.partition("=")
     try:
-        visualize_layered_solution(image_name, mesh_domain, c, title=f"Na+ concentration t={t_curr:.3f}s")
-        print(f"  Exported visualization: assets/{image_name}.html")
-    except Exception as e:
-        print(f"  Warning: Visualization failed - {e}")
-    
-    # Update time level
-    c_n.x.array[:] = c.x.array
-    c_n.x.scatter_forward()
-
-end_time = time.time()
-print(f"\n[{datetime.now().isoformat()}] Simulation completed!")
-print(f"  Wall-clock time: {end_time - start_time:.2f}s")
-print(f"  All visualizations saved to assets/ directory")
\ No newline at end of file
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def config_from_args(args):
+    """Configuration overrides from --config and the individual CLI flags"""
+    overrides = {}
+    if args.config:
+        with open(args.config) as f:
+            overrides.update(json.load(f))
+    for key in ("ny", "n_anode", "n_mem", "n_cathode", "mesh_scale", "cell_type", "degree",
+                "T", "num_steps", "output_format", "output_dir", "timings_json", "report_json",
+                "darcy_solve_every", "supg_tau", "species_solve", "species_initial_guess",
+                "species_guess_basis", "dt_tol", "dt_min", "dt_max", "steady_tol",
+                "checkpoint_every", "checkpoint_dir", "jit_cache_dir", "petsc_options_file",
+                "species_solver", "phi_coupling", "diagnostics_file", "diagnostics_every"):
+        value = getattr(args, key, None)
+        if value is not None:
+            overrides[key] = value
+    if getattr(args, "no_output", False):
+        overrides["output_format"] = None
+    if getattr(args, "viz", False):
+        overrides["viz_enabled"] = True
+    if getattr(args, "restart", False):
+        overrides["restart"] = True
+    if getattr(args, "adaptive_dt", False):
+        overrides["adaptive_dt"] = True
+    if getattr(args, "petsc_log_stages", False):
+        overrides["petsc_log_stages"] = True
+    for item in getattr(args, "region_constant", None) or []:
+        path, value = parse_key_value(item)
+        region, _, name = path.partition(".")
+        overrides.setdefault("region_constants", {}).setdefault(region, {})[name] = value
+    for item in getattr(args, "physics_term", None) or []:
+        term, value = parse_key_value(item)
+        overrides.setdefault("physics_terms", {})[term] = value
+    for item in getattr(args, "quadrature_degree", None) or []:
+        term, _, degree = item.rpartition("=")
+        terms = [term] if term else list(DEFAULT_CONFIG["quadrature_degree"])
+        for name in terms:
+            overrides.setdefault("quadrature_degree", {})[name] = int(degree)
+    for item in getattr(args, "snes_option", None) or []:
+        key, value = parse_key_value(item)
+        overrides.setdefault("snes_options", {})[key] = value
+    for item in getattr(args, "petsc_option", None) or []:
+        key, value = parse_key_value(item)
+        overrides.setdefault("petsc_options", {})[key] = value
+    return overrides
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--config", help="JSON file with configuration overrides")
+    parser.add_argument("--ny", type=int)
+    parser.add_argument("--n-anode", dest="n_anode", type=int)
+    parser.add_argument("--n-mem", dest="n_mem", type=int)
+    parser.add_argument("--n-cathode", dest="n_cathode", type=int)
+    parser.add_argument("--mesh-scale", dest="mesh_scale", type=int, help="multiplies ny")
+    parser.add_argument("--cell-type", dest="cell_type", choices=["triangle", "quadrilateral"])
+    parser.add_argument("--degree", type=int)
+    parser.add_argument("--T", type=float)
+    parser.add_argument("--num-steps", dest="num_steps", type=int)
+    parser.add_argument("--adaptive-dt", dest="adaptive_dt", action="store_true",
+                        help="step-doubling error control of dt (num_steps sets the initial dt)")
+    parser.add_argument("--dt-tol", dest="dt_tol", type=float)
+    parser.add_argument("--dt-min", dest="dt_min", type=float)
+    parser.add_argument("--dt-max", dest="dt_max", type=float)
+    parser.add_argument("--steady-tol", dest="steady_tol", type=float,
+                        help="stop once ||c - c_n||/||c_n|| falls below this")
+    parser.add_argument("--checkpoint-every", dest="checkpoint_every", type=int,
+                        help="write a checkpoint every N steps")
+    parser.add_argument("--checkpoint-dir", dest="checkpoint_dir")
+    parser.add_argument("--restart", action="store_true",
+                        help="resume from the latest checkpoint in the checkpoint directory")
+    parser.add_argument("--output-format", dest="output_format", choices=["xdmf", "vtx"])
+    parser.add_argument("--no-output", dest="no_output", action="store_true")
+    parser.add_argument("--output-dir", dest="output_dir")
+    parser.add_argument("--viz", action="store_true", help="export HTML snapshots")
+    parser.add_argument("--darcy-solve-every", dest="darcy_solve_every", type=int)
+    parser.add_argument("--species-solve", dest="species_solve", choices=["batched", "separate"],
+                        help="share one operator between species with identical constants")
+    parser.add_argument("--initial-guess", dest="species_initial_guess",
+                        choices=list(InitialGuess.POLICIES), help="species KSP initial guess")
+    parser.add_argument("--guess-basis", dest="species_guess_basis", type=int,
+                        help="solutions kept for the projection initial guess")
+    parser.add_argument("--supg-tau", dest="supg_tau", choices=["expression", "cellwise"])
+    parser.add_argument("--jit-cache-dir", dest="jit_cache_dir",
+                        help="persistent form-compilation cache (shared between jobs)")
+    parser.add_argument("--timings-json", dest="timings_json")
+    parser.add_argument("--report-json", dest="report_json",
+                        help="per-phase time/RSS and per-step KSP statistics")
+    parser.add_argument("--diagnostics", dest="diagnostics_file", metavar="FILE",
+                        help="per-step region mass and flux diagnostics (.csv or .json)")
+    parser.add_argument("--diagnostics-every", dest="diagnostics_every", type=int)
+    parser.add_argument("--petsc-log-stages", dest="petsc_log_stages", action="store_true",
+                        help="one PETSc log stage per phase (combine with -log_view)")
+    parser.add_argument("--region-constant", dest="region_constant", action="append",
+                        metavar="REGION.KEY=VALUE", help="e.g. membrane.Pe=50")
+    parser.add_argument("--physics-term", dest="physics_term", action="append",
+                        metavar="TERM=auto|true|false",
+                        help="keep/drop a species-form term: " + ", ".join(DEFAULT_CONFIG["physics_terms"]))
+    parser.add_argument("--quadrature-degree", dest="quadrature_degree", action="append",
+                        metavar="[TERM=]DEGREE",
+                        help="species-form quadrature degree, for all terms or one of "
+                             + ", ".join(DEFAULT_CONFIG["quadrature_degree"]))
+    parser.add_argument("--species-solver", dest="species_solver", choices=["linear", "newton"])
+    parser.add_argument("--phi-coupling", dest="phi_coupling", type=float,
+                        help="potential Phi + k*c in the migration terms (newton)")
+    parser.add_argument("--snes-option", dest="snes_option", action="append", metavar="KEY=VALUE",
+                        help="e.g. snes_lag_jacobian=3 or snes_lag_preconditioner_persists=true")
+    parser.add_argument("--petsc-options-file", dest="petsc_options_file",
+                        help="species KSP/PC chosen by autotune-pc (JSON)")
+    parser.add_argument("--petsc-option", dest="petsc_option", action="append",
+                        metavar="KEY=VALUE", help="species KSP/PC option, e.g. pc_type=gamg")
+
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Layered species + Darcy simulation (DOLFINx 0.9.0)")
+    commands = parser.add_subparsers(dest="command")
+
+    add_config_arguments(commands.add_parser("run", help="run the simulation (default)"))
+
+    bench_mesh = commands.add_parser("benchmark-mesh", help="mesh generation time and RSS, 1e4..1e7 cells")
+    bench_mesh.add_argument("--cell-type", dest="cell_type", default="triangle",
+                            choices=["triangle", "quadrilateral"])
+    bench_mesh.add_argument("--no-create-mesh", dest="build_mesh", action="store_false")
+    bench_mesh.add_argument("--output", default="mesh_benchmark.json")
+
+    bench_tau = commands.add_parser("benchmark-supg-tau",
+                                    help="UFL coth tau vs precomputed DG0 tau: compile/assembly time, kernel size")
+    add_config_arguments(bench_tau)
+    bench_tau.add_argument("--repeats", type=int, default=5)
+    bench_tau.add_argument("--output", default="supg_tau_benchmark.json")
+
+    bench_quad = commands.add_parser("benchmark-quadrature",
+                                     help="quadrature-degree sweep: assembly time, kernel size, error")
+    add_config_arguments(bench_quad)
+    bench_quad.add_argument("--degrees", type=int, nargs="+", default=list(range(2, 9)))
+    bench_quad.add_argument("--reference-degree", dest="reference_degree", type=int, default=12)
+    bench_quad.add_argument("--repeats", type=int, default=5)
+    bench_quad.add_argument("--output", default="quadrature_benchmark.json")
+
+    warmup = commands.add_parser("warmup", help="precompile the forms of a configuration into the JIT cache")
+    add_config_arguments(warmup)
+    warmup.add_argument("--all-variants", dest="all_variants", action="store_true",
+                        help=f"also compile every {' / '.join(WARMUP_VARIANTS)} variant")
+
+    bench_startup = commands.add_parser("benchmark-startup", help="startup time with a cold vs warm JIT cache")
+    bench_startup.add_argument("--repeats", type=int, default=2)
+    bench_startup.add_argument("--output", default="startup_benchmark.json")
+
+    sweep = commands.add_parser("sweep", help="parameter sweep over a local process pool")
+    add_config_arguments(sweep)
+    sweep.add_argument("--grid", action="append", metavar="KEY=[V1,V2,...]",
+                       help="e.g. region_constants.anode.Pe=[10,100] or Da_val=[1e-5,1e-4]")
+    sweep.add_argument("--cases", help="JSON file with a list of parameter sets")
+    sweep.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    sweep.add_argument("--output", default="sweep.csv", help=".csv or .json")
+
+    autotune = commands.add_parser("autotune-pc",
+                                   help="benchmark species KSP/PC candidates per mesh size, save the fastest")
+    add_config_arguments(autotune)
+    autotune.add_argument("--mesh-scales", dest="mesh_scales", type=int, nargs="+", default=[1, 2, 4])
+    autotune.add_argument("--candidates", nargs="+", choices=list(PC_CANDIDATES))
+    autotune.add_argument("--output", default="pc_benchmark.json")
+    autotune.add_argument("--save", default="solver_choice.json",
+                          help="selected options, reused with --petsc-options-file")
+
+    scaling = commands.add_parser("scaling", help="strong/weak scaling over 1..N MPI ranks (run serially)")
+    scaling.add_argument("kind", choices=["strong", "weak"])
+    scaling.add_argument("--max-ranks", dest="max_ranks", type=int, default=os.cpu_count() or 1)
+    scaling.add_argument("--mesh-scale", dest="mesh_scale", type=int, default=1)
+    scaling.add_argument("--launcher", default="mpirun")
+    return parser
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Plain `subdomain_supg.py [options]` means `run`
+    if not argv or argv[0].startswith("-") and argv[0] not in ("-h", "--help"):
+        argv.insert(0, "run")
+    # Single-dash options (e.g. -log_view) are PETSc's, read by petsc4py from sys.argv
+    parser = build_parser()
+    args, unknown = parser.parse_known_args(argv)
+    unknown = [arg for arg in unknown if arg.startswith("--")]
+    if unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    comm = MPI.COMM_WORLD
+
+    if args.command == "benchmark-mesh":
+        if comm.rank == 0:
+            print(f"[{datetime.now().isoformat()}] Benchmarking layered mesh generation ({args.cell_type})...")
+        results = benchmark_mesh_generation(comm, cell_type=args.cell_type, build_mesh=args.build_mesh)
+        if comm.rank == 0:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if args.command == "benchmark-supg-tau":
+        if comm.rank == 0:
+            print(f"[{datetime.now().isoformat()}] Benchmarking SUPG tau (expression vs cellwise)...")
+        results = benchmark_supg_tau(config_from_args(args), comm, repeats=args.repeats)
+        if comm.rank == 0:
+            print(f"  relative solution difference: {results['relative_difference']:.3e}")
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if args.command == "benchmark-quadrature":
+        if comm.rank == 0:
+            print(f"[{datetime.now().isoformat()}] Sweeping species-form quadrature degree "
+                  f"(reference {args.reference_degree})...")
+        results = benchmark_quadrature_degree(config_from_args(args), comm, degrees=args.degrees,
+                                              reference_degree=args.reference_degree,
+                                              repeats=args.repeats)
+        if comm.rank == 0:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if args.command == "warmup":
+        if comm.rank == 0:
+            print(f"[{datetime.now().isoformat()}] Precompiling forms...")
+        warmup_forms(config_from_args(args), comm, all_variants=args.all_variants)
+        return 0
+
+    if args.command == "benchmark-startup":
+        results = benchmark_startup(os.path.abspath(__file__), repeats=args.repeats)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    if args.command == "sweep":
+        cases = []
+        if args.cases:
+            with open(args.cases) as f:
+                cases.extend(json.load(f))
+        if args.grid:
+            cases.extend(expand_parameter_grid(dict(parse_key_value(item) for item in args.grid)))
+        if not cases:
+            parser.error("sweep needs --grid and/or --cases")
+        print(f"[{datetime.now().isoformat()}] Sweeping {len(cases)} case(s) on {args.workers} worker(s)...")
+        rows = run_parameter_sweep(config_from_args(args), cases, workers=args.workers)
+        write_table(rows, args.output)
+        return 0
+
+    if args.command == "autotune-pc":
+        if comm.rank == 0:
+            print(f"[{datetime.now().isoformat()}] Benchmarking species preconditioners...")
+        results = benchmark_preconditioners(config_from_args(args), comm, mesh_scales=args.mesh_scales,
+                                            candidates=args.candidates)
+        choice = select_preconditioner(results)
+        if comm.rank == 0:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+            save_solver_choice(args.save, choice)
+            print(f"  Selected {choice['candidate']} for {comm.size} rank(s) -> {args.save} "
+                  f"(use --petsc-options-file {args.save})")
+        return 0
+
+    if args.command == "scaling":
+        results = run_scaling_study(os.path.abspath(__file__), args.max_ranks, kind=args.kind,
+                                    base_scale=args.mesh_scale, launcher=args.launcher)
+        with open(f"scaling_{args.kind}.json", "w") as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    Simulation(config_from_args(args), comm=comm).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
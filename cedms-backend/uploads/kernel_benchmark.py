@@ -0,0 +1,358 @@
+"""
+Benchmark harness for the array kernels of single_core.py and multi_core.py
+- a kernel advances u by num_steps updates u += dt and returns the (global)
+  total after every step; "two-pass" updates and then sums the whole array,
+  the fused kernels do both in one cache-blocked pass (NumPy, or Numba when
+  it is installed)
+- time_kernel(): warmup runs, then timed repetitions; the array is created
+  outside the timed region and nothing is printed inside it
+- summarize(): median and percentile times, effective memory bandwidth
+  (GB/s) and, against a serial baseline, speedup and parallel efficiency
+- ThreadPoolKernel / ProcessPoolKernel run a kernel over blocks of one
+  array on a single node, in threads (NumPy and the Numba kernel release
+  the GIL) or in processes over multiprocessing.shared_memory
+- results are written as JSON (with host information) so runs can be
+  compared across hosts
+"""
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import threading
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# --------------------------
+# Kernels
+# --------------------------
+def two_pass_update_sum(u, dt):
+    """u += dt, then np.sum(u)"""
+    u += dt
+    return float(np.sum(u))
+
+
+def two_pass_steps(u, num_steps, dt, allreduce=None):
+    """u += dt, then np.sum(u), per step (two passes over memory)"""
+    totals = []
+    for step in range(num_steps):
+        u += dt
+        total = np.sum(u)
+        totals.append(float(allreduce(total) if allreduce is not None else total))
+    return totals
+
+
+# Elements per block of the fused kernels: 2**15 float64 values (256 KiB) stay in
+# L2 between the update and the sum, so u is streamed from memory only once
+DEFAULT_BLOCK = 2**15
+
+
+def fused_update_sum(u, dt, block=DEFAULT_BLOCK):
+    """u += dt and return sum(u), block by block in a single pass over memory"""
+    total = 0.0
+    for start in range(0, u.size, block):
+        chunk = u[start:start + block]
+        chunk += dt
+        total += float(chunk.sum())
+    return total
+
+
+if numba is not None:
+    # fastmath lets the reduction vectorize (the summation order is not NumPy's)
+    # nogil lets the thread-pool mode run it concurrently
+    @numba.njit(cache=True, fastmath=True, nogil=True)
+    def fused_update_sum_numba(u, dt):
+        """u += dt and return sum(u) in one loop"""
+        total = 0.0
+        for i in range(u.size):
+            u[i] += dt
+            total += u[i]
+        return total
+else:
+    fused_update_sum_numba = None
+
+
+def fused_steps(u, num_steps, dt, allreduce=None, update_sum=fused_update_sum):
+    """Per step, the fused update + sum (update_sum(u, dt))"""
+    totals = []
+    for step in range(num_steps):
+        total = update_sum(u, dt)
+        totals.append(float(allreduce(total) if allreduce is not None else total))
+    return totals
+
+
+# name -> (kernel, bytes moved per element and step in units of the itemsize):
+# two-pass reads and writes u in the update and reads it again in the sum, the
+# fused kernels read and write it once
+KERNELS = {
+    "two-pass": (two_pass_steps, 3),
+    "fused": (fused_steps, 2),
+}
+if numba is not None:
+    KERNELS["fused-numba"] = (partial(fused_steps, update_sum=fused_update_sum_numba), 2)
+
+
+def get_kernel(name, block=DEFAULT_BLOCK):
+    """(kernel, traffic) of a registered kernel, with the block size of the NumPy fused kernel"""
+    kernel, traffic = KERNELS[name]
+    if name == "fused":
+        kernel = partial(fused_steps, update_sum=partial(fused_update_sum, block=block))
+    return kernel, traffic
+
+
+def get_update_sum(name, block=DEFAULT_BLOCK):
+    """The single-step update_sum(u, dt) of a registered kernel"""
+    return {
+        "two-pass": two_pass_update_sum,
+        "fused": partial(fused_update_sum, block=block),
+        "fused-numba": fused_update_sum_numba,
+    }[name]
+
+
+def partition(n, parts):
+    """(start, stop) of each part; the first n % parts parts get one extra element"""
+    base, remainder = divmod(n, parts)
+    sizes = [base + 1 if i < remainder else base for i in range(parts)]
+    stops = np.cumsum(sizes)
+    return [(int(stop - size), int(stop)) for size, stop in zip(sizes, stops)]
+
+
+# --------------------------
+# Shared-memory execution (one node, no MPI)
+# --------------------------
+class ThreadPoolKernel:
+    """
+    Kernel over blocks of u in a thread pool: per step, every worker runs
+    update_sum on its block and the partial sums are added in block order.
+    The pool is created, and every thread started, outside the timed region.
+    """
+
+    def __init__(self, name, workers, block=DEFAULT_BLOCK):
+        self.update_sum = get_update_sum(name, block)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # ThreadPoolExecutor starts threads on demand: one task per worker that
+        # waits for all the others makes it start every thread now
+        barrier = threading.Barrier(workers)
+        for future in [self.executor.submit(barrier.wait) for _ in range(workers)]:
+            future.result()
+
+    def __call__(self, u, num_steps, dt, allreduce=None):
+        bounds = partition(u.size, self.workers)
+        totals = []
+        for step in range(num_steps):
+            futures = [self.executor.submit(self.update_sum, u[start:stop], dt) for start, stop in bounds]
+            totals.append(sum(float(future.result()) for future in futures))
+        return totals
+
+    def make_array(self, n, dtype):
+        return np.ones(n, dtype=dtype)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+# Per-process state of a ProcessPoolKernel worker (set by _attach_shared_array)
+_worker = {}
+
+
+def _attach_shared_array(shm_name, n, dtype, name, block):
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # Python < 3.13: no track argument
+        shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(shm=shm, u=np.ndarray(n, dtype=dtype, buffer=shm.buf),
+                   update_sum=get_update_sum(name, block))
+
+
+def _shared_update_sum(start, stop, dt):
+    return float(_worker["update_sum"](_worker["u"][start:stop], dt))
+
+
+def _warm_worker():
+    """Run update_sum once on a private element (loads or compiles a Numba kernel)"""
+    _worker["update_sum"](np.ones(1, dtype=_worker["u"].dtype), 0.0)
+
+
+class ProcessPoolKernel:
+    """
+    Kernel over blocks of one array in multiprocessing.shared_memory, run by
+    a process pool: the workers attach to the array once, and per step only
+    (start, stop, dt) and the partial sums cross process boundaries. Every
+    worker is started (and its kernel warmed) outside the timed region.
+    """
+
+    def __init__(self, name, workers, n, dtype, block=DEFAULT_BLOCK):
+        dtype = np.dtype(dtype)
+        self.workers = workers
+        self.shm = shared_memory.SharedMemory(create=True, size=max(n * dtype.itemsize, 1))
+        self.u = np.ndarray(n, dtype=dtype, buffer=self.shm.buf)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared_array,
+                                            initargs=(self.shm.name, n, dtype.str, name, block))
+        # Processes are spawned on demand while no worker is idle: submitting
+        # one task per worker before waiting on any starts all of them
+        for future in [self.executor.submit(_warm_worker) for _ in range(workers)]:
+            future.result()
+
+    def __call__(self, u, num_steps, dt, allreduce=None):
+        # u is the shared array from make_array(); the workers update it in place
+        bounds = partition(u.size, self.workers)
+        totals = []
+        for step in range(num_steps):
+            futures = [self.executor.submit(_shared_update_sum, start, stop, dt) for start, stop in bounds]
+            totals.append(sum(future.result() for future in futures))
+        return totals
+
+    def make_array(self, n, dtype):
+        """u(x, 0) = 1 in the shared array (the same buffer on every run)"""
+        self.u.fill(1)
+        return self.u
+
+    def close(self):
+        self.executor.shutdown()
+        del self.u
+        self.shm.close()
+        self.shm.unlink()
+
+
+def expected_totals(n, num_steps, dt):
+    """Exact totals for u(x, 0) = 1: n * (1 + (step + 1) * dt)"""
+    return [n * (1.0 + (step + 1) * dt) for step in range(num_steps)]
+
+
+def max_relative_error(totals, expected):
+    return max(abs(a - b) / abs(b) for a, b in zip(totals, expected))
+
+
+# --------------------------
+# Timing and statistics
+# --------------------------
+def time_kernel(kernel, make_array, num_steps, dt, repeats=5, warmup=1, allreduce=None,
+                barrier=None, max_time=None):
+    """
+    Run kernel(make_array(), num_steps, dt) warmup + repeats times and return
+    (timed wall times, totals of the last run). For MPI runs, barrier() lines
+    the ranks up before each run and max_time() reduces a time to the slowest rank.
+    """
+    times = []
+    totals = None
+    for run in range(warmup + repeats):
+        u = make_array()
+        if barrier is not None:
+            barrier()
+        t0 = time.perf_counter()
+        totals = kernel(u, num_steps, dt, allreduce=allreduce)
+        elapsed = time.perf_counter() - t0
+        if max_time is not None:
+            elapsed = max_time(elapsed)
+        if run >= warmup:
+            times.append(elapsed)
+        del u
+    return times, totals
+
+
+def summarize(times, n, itemsize, num_steps, traffic, workers=1, baseline_s=None,
+              percentiles=(10, 90)):
+    """
+    Statistics of the timed runs. bandwidth_gbs counts traffic * n * itemsize
+    bytes per step at the median time; efficiency is baseline / (workers * median).
+    """
+    times = np.asarray(times, dtype=float)
+    median = float(np.median(times))
+    summary = {
+        "repeats": int(times.size),
+        "times_s": times.tolist(),
+        "median_s": median,
+        "mean_s": float(times.mean()),
+        "min_s": float(times.min()),
+        "max_s": float(times.max()),
+        "percentiles_s": {f"p{p:g}": float(np.percentile(times, p)) for p in percentiles},
+        "per_step_s": median / num_steps,
+        "bytes_per_step": int(traffic * n * itemsize),
+        "bandwidth_gbs": traffic * n * itemsize * num_steps / median / 1e9,
+        "workers": workers,
+    }
+    if baseline_s is not None:
+        summary["baseline_s"] = baseline_s
+        summary["speedup"] = baseline_s / median
+        summary["efficiency"] = baseline_s / (workers * median)
+    return summary
+
+
+def format_summary(label, summary):
+    """One-line report of a summary"""
+    percentiles = ", ".join(f"{k}={v:.4f}s" for k, v in summary["percentiles_s"].items())
+    line = (f"[{label}] median={summary['median_s']:.4f}s ({percentiles}), "
+            f"{summary['bandwidth_gbs']:.2f} GB/s, workers={summary['workers']}")
+    if "efficiency" in summary:
+        line += f", speedup={summary['speedup']:.2f}, efficiency={summary['efficiency']:.1%}"
+    return line
+
+
+def compare_kernels(kernels, reference="two-pass"):
+    """Add each kernel's speedup over the reference kernel (median times); returns the lines to print"""
+    if reference not in kernels:
+        return []
+    lines = []
+    for name, summary in kernels.items():
+        if name != reference:
+            summary[f"speedup_vs_{reference}"] = kernels[reference]["median_s"] / summary["median_s"]
+            lines.append(f"{name} vs {reference}: {summary[f'speedup_vs_{reference}']:.2f}x")
+    return lines
+
+
+# --------------------------
+# Results
+# --------------------------
+def host_info():
+    return {
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "numba": numba.__version__ if numba is not None else None,
+    }
+
+
+def write_results(path, results):
+    """Results with host information and a timestamp, as JSON"""
+    results = {"created": datetime.now().isoformat(), "host": host_info(), **results}
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+def load_baseline(path, kernel):
+    """Median serial time of a kernel from a single_core.py --json file"""
+    with open(path) as f:
+        return json.load(f)["kernels"][kernel]["median_s"]
+
+
+def add_benchmark_arguments(parser):
+    parser.add_argument("--n", type=int, default=10_000_000, help="global array length")
+    parser.add_argument("--steps", type=int, default=5, help="timesteps per run")
+    parser.add_argument("--dt", type=float, default=0.1)
+    parser.add_argument("--dtype", default="float64", choices=["float64", "float32"])
+    parser.add_argument("--repeats", type=int, default=5, help="timed runs")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the timed ones")
+    parser.add_argument("--percentiles", type=float, nargs="+", default=[10, 90])
+    parser.add_argument("--kernels", nargs="+", default=list(KERNELS), choices=list(KERNELS),
+                        help="kernels to compare (default: all available)")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK,
+                        help="elements per block of the fused NumPy kernel")
+    parser.add_argument("--json", help="write the results to this JSON file")
+    return parser
@@ -0,0 +1,70 @@
+import os
+import argparse
+import numpy as np
+
+from kernel_benchmark import (ProcessPoolKernel, ThreadPoolKernel, add_benchmark_arguments, compare_kernels,
+                              expected_totals, format_summary, get_kernel, load_baseline, max_relative_error,
+                              summarize, time_kernel, write_results)
+
+
+def make_pool_kernel(pool, name, workers, N, dtype, block):
+    if pool == "threads":
+        return ThreadPoolKernel(name, workers, block=block)
+    return ProcessPoolKernel(name, workers, N, dtype, block=block)
+
+
+def main(argv=None):
+    parser = add_benchmark_arguments(argparse.ArgumentParser(
+        description="Single-node shared-memory benchmark of the u += dt / total timestep kernels"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="threads or processes")
+    parser.add_argument("--pool", default="threads", choices=["threads", "processes"],
+                        help="thread pool (NumPy releases the GIL) or process pool over shared memory")
+    parser.add_argument("--baseline", help="single_core.py --json results for the serial baseline "
+                                           "(default: measured here before the pool runs)")
+    args = parser.parse_args(argv)
+
+    # Problem size: global array length, number of timesteps and timestep size
+    N, num_steps, dt = args.n, args.steps, args.dt
+    dtype = np.dtype(args.dtype)
+    workers = args.workers
+
+    results = {"mode": args.pool, "n": N, "steps": num_steps, "dt": dt, "dtype": dtype.name,
+               "warmup": args.warmup, "block_size": args.block_size, "workers": workers, "kernels": {}}
+    for name in args.kernels:
+        # Serial baseline for the parallel efficiency (same kernel, one core)
+        if args.baseline:
+            baseline_s = load_baseline(args.baseline, name)
+        else:
+            kernel, _ = get_kernel(name, block=args.block_size)
+            baseline_times, _ = time_kernel(kernel, lambda: np.ones(N, dtype=dtype), num_steps, dt,
+                                            repeats=args.repeats, warmup=args.warmup)
+            baseline_s = float(np.median(baseline_times))
+        _, traffic = get_kernel(name)
+
+        # The pool (and the shared array) is set up outside the timed region
+        kernel = make_pool_kernel(args.pool, name, workers, N, dtype, args.block_size)
+        try:
+            times, totals = time_kernel(kernel, lambda: kernel.make_array(N, dtype), num_steps, dt,
+                                        repeats=args.repeats, warmup=args.warmup)
+        finally:
+            kernel.close()
+        summary = summarize(times, N, dtype.itemsize, num_steps, traffic, workers=workers,
+                            baseline_s=baseline_s, percentiles=args.percentiles)
+        summary["final_total"] = totals[-1]
+        summary["max_relative_error"] = max_relative_error(totals, expected_totals(N, num_steps, dt))
+        results["kernels"][name] = summary
+        print(format_summary(f"{args.pool}:{name}", summary)
+              + f", total={totals[-1]:.2f} (rel. error {summary['max_relative_error']:.1e})")
+
+    # Fused single-pass kernels against the two-pass update + sum
+    for line in compare_kernels(results["kernels"]):
+        print(f"[{args.pool}] {line}")
+
+    if args.json:
+        write_results(args.json, results)
+        print(f"[{args.pool}] Results written to {args.json} (workers = {workers})")
+    return results
+
+
+if __name__ == "__main__":
+    main()